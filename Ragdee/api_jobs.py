@@ -0,0 +1,100 @@
+import os
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# progress(done, total, stage)
+JobProgress = Callable[[int, int, str], None]
+
+
+class JobManager:
+    """
+    Runs document-processing jobs on a dedicated worker pool, off the event loop.
+
+    - submit() returns a job id immediately; status() / result() are cheap reads.
+    - run() queues the same way but hands back a Future for callers that wait for the outcome.
+    - Workers report progress through the callback they are given.
+    - Only the most recent `max_history` finished jobs are kept.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_history: Optional[int] = None) -> None:
+        self.max_workers = max_workers or int(os.getenv("PROCESS_WORKERS", "1"))
+        self.max_history = max_history or int(os.getenv("JOB_HISTORY", "100"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="doc-job")
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._results: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[[JobProgress], Any], **info: Any) -> str:
+        """Queue fn(progress); extra keyword info (e.g. filename) is echoed in the job status."""
+        return self._enqueue(fn, info)[0]
+
+    def run(self, fn: Callable[[JobProgress], Any], **info: Any) -> "Future[Any]":
+        """Queue fn(progress) like submit(); the Future resolves to its result or raises its error."""
+        return self._enqueue(fn, info)[1]
+
+    def _enqueue(self, fn: Callable[[JobProgress], Any], info: Dict[str, Any]) -> Tuple[str, "Future[Any]"]:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "progress": {"done": 0, "total": 0, "stage": "queued"},
+                "error": None,
+                "created": time.time(),
+                "started": None,
+                "finished": None,
+                **info,
+            }
+            self._prune()
+        return job_id, self._executor.submit(self._run, job_id, fn)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job, progress=dict(job["progress"]))
+
+    def result(self, job_id: str) -> Any:
+        with self._lock:
+            return self._results.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(job, progress=dict(job["progress"])) for job in self._jobs.values()]
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job_id: str, fn: Callable[[JobProgress], Any]) -> Any:
+        self._update(job_id, status="running", started=time.time())
+
+        def progress(done: int, total: int, stage: str) -> None:
+            self._update(job_id, progress={"done": done, "total": total, "stage": stage})
+
+        try:
+            result = fn(progress)
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            print(f"Job {job_id} failed: {detail}\n{traceback.format_exc()}")
+            self._update(job_id, status="failed", error=detail, finished=time.time())
+            raise
+        with self._lock:
+            self._results[job_id] = result
+        self._update(job_id, status="done", finished=time.time())
+        return result
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _prune(self) -> None:
+        finished = [jid for jid, job in self._jobs.items() if job["status"] in ("done", "failed")]
+        for jid in finished[: max(0, len(finished) - self.max_history)]:
+            self._jobs.pop(jid, None)
+            self._results.pop(jid, None)
@@ -1,14 +1,20 @@
 import os
-import io
 import time
+import shutil
+import asyncio
+import threading
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from PIL import Image, ImageDraw
-from rag_router import router as rag_router
+from api_jobs import JobManager, JobProgress
+from rag_manifest import write_run_manifest
+from rag_router import router as rag_router, restore_rag_service
 
 # Lazy imports of repo modules to avoid heavy init until used
 from importlib import import_module
@@ -25,7 +31,14 @@ OUTPUT_ROOT = _ensure_dir(os.path.join(BASE_DIR, "api_outputs"))
 utils = import_module("utils.utils")
 demo_page = import_module("demo_page")
 
-app = FastAPI(title="Dolphin API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Reload the persisted RAG index (memory-mapped) instead of rebuilding it
+    restore_rag_service(app)
+    yield
+    JOBS.shutdown()
+
+app = FastAPI(title="Dolphin API", version="0.1.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],
@@ -40,13 +53,24 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 app.include_router(rag_router, prefix="/rag")
 
 MODEL_CACHE: Dict[str, Any] = {}
+_MODEL_LOCK = threading.Lock()
+# Document jobs run here (PROCESS_WORKERS threads), never on the event loop
+JOBS = JobManager()
+# PDF pages buffered between pipeline stages
+PIPELINE_PREFETCH = int(os.getenv("PIPELINE_PREFETCH", "2"))
+# PDF pages whose element crops are batched together for decoding
+ELEMENT_BATCH_PAGES = int(os.getenv("ELEMENT_BATCH_PAGES", "4"))
+# Max total crop area (pixels) per element batch; large crops get smaller batches
+ELEMENT_BATCH_AREA = int(os.getenv("ELEMENT_BATCH_AREA", str(demo_page.DEFAULT_BATCH_AREA)))
 
 def get_model(model_path: str = DEFAULT_MODEL_PATH):
-    if model_path in MODEL_CACHE:
-        return MODEL_CACHE[model_path]
-    model = demo_page.DOLPHIN(model_path)
-    MODEL_CACHE[model_path] = model
-    return model
+    # Worker threads may race on first use; load each model only once
+    with _MODEL_LOCK:
+        if model_path in MODEL_CACHE:
+            return MODEL_CACHE[model_path]
+        model = demo_page.DOLPHIN(model_path)
+        MODEL_CACHE[model_path] = model
+        return model
 
 @app.get("/api/health")
 def health():
@@ -86,84 +110,53 @@ def render_overlay(pil_image: Image.Image, results: List[Dict[str, Any]], save_p
     merged.save(save_path)
     return save_path
 
-@app.post("/api/process")
-async def process_document(file: UploadFile = File(...), max_batch_size: int = 16, model_path: str = DEFAULT_MODEL_PATH):
-    try:
-        # Prepare run directory
-        run_id = datetime.now().strftime("run_%Y%m%d_%H%M%S")
-        run_dir = _ensure_dir(os.path.join(OUTPUT_ROOT, run_id))
-        utils.setup_output_dirs(run_dir)
-
-        # Persist upload to disk
-        filename = os.path.basename(file.filename)
-        upload_path = os.path.join(run_dir, filename)
-        content = await file.read()
-        with open(upload_path, "wb") as f:
-            f.write(content)
-
-        # Load model once
-        model = get_model(model_path)
-
-        # Handle PDFs (multi-page) vs images
-        ext = os.path.splitext(filename)[1].lower()
-        result_payload: Dict[str, Any] = {"run_id": run_id, "source": filename}
-
-        if ext == ".pdf":
-            # Convert PDF to images and process each page
-            images = utils.convert_pdf_to_images(upload_path)
-            if not images:
-                raise HTTPException(status_code=400, detail="Failed to convert PDF to images")
-
-            pages = []
-            for idx, pil_image in enumerate(images):
-                page_name = f"{os.path.splitext(filename)[0]}_page_{idx+1:03d}"
-                json_path, recognition_results = demo_page.process_single_image(
-                    pil_image, model, run_dir, page_name, max_batch_size=max_batch_size, save_individual=False
-                )
-                # Render overlay
-                overlay_name = f"{page_name}_overlay.png"
-                overlay_path = os.path.join(STATIC_DIR, overlay_name)
-                render_overlay(pil_image, recognition_results, overlay_path)
-
-                # Map to client schema
-                items = [
-                    {
-                        "order": r.get("reading_order", i+1),
-                        "type": r.get("label", "paragraph"),
-                        "bbox": r.get("bbox", [0,0,0,0]),
-                        "text": r.get("text", ""),
-                    }
-                    for i, r in enumerate(recognition_results)
-                ]
-
-                pages.append({
-                    "page": idx+1,
-                    "items": items,
-                    "overlay_url": f"/static/{overlay_name}",
-                    "json_path": json_path or ""
-                })
-
-            # Save combined JSON/markdown
-            combined_json_path = utils.save_combined_pdf_results(
-                [{"page_number": p["page"], "elements": [
-                    {"label": it["type"], "bbox": it["bbox"], "text": it.get("text",""), "reading_order": it["order"]}
-                 for it in p["items"]]} for p in pages],
-                upload_path,
-                run_dir
-            )
-            result_payload.update({"type": "pdf", "pages": pages, "combined_json": combined_json_path})
-            return result_payload
-        else:
-            # Single image flow
-            pil_image = Image.open(io.BytesIO(content)).convert("RGB")
-            base_name = os.path.splitext(filename)[0]
-            json_path, recognition_results = demo_page.process_single_image(
-                pil_image, model, run_dir, base_name, max_batch_size=max_batch_size, save_individual=True
-            )
-            overlay_name = f"{base_name}_overlay.png"
+async def _save_upload(file: UploadFile) -> Dict[str, str]:
+    """Create a run directory and persist the upload there, so queued jobs hold a path, not the bytes."""
+    # Microseconds keep concurrent uploads in separate, still chronologically sortable, run dirs
+    run_id = datetime.now().strftime("run_%Y%m%d_%H%M%S_%f")
+    run_dir = _ensure_dir(os.path.join(OUTPUT_ROOT, run_id))
+    utils.setup_output_dirs(run_dir)
+    filename = os.path.basename(file.filename)
+    upload_path = os.path.join(run_dir, filename)
+    with open(upload_path, "wb") as f:
+        await run_in_threadpool(shutil.copyfileobj, file.file, f)
+    return {"run_id": run_id, "run_dir": run_dir, "filename": filename, "upload_path": upload_path}
+
+
+def _process_upload(run: Dict[str, str], max_batch_size: int, model_path: str, progress: Optional[JobProgress] = None) -> Dict[str, Any]:
+    """Blocking document pipeline (rasterize, recognize, render overlays); runs on a JOBS worker."""
+    run_id, run_dir, filename, upload_path = run["run_id"], run["run_dir"], run["filename"], run["upload_path"]
+    report = progress or (lambda done, total, stage: None)
+
+    # Load model once
+    report(0, 0, "loading model")
+    model = get_model(model_path)
+
+    # Handle PDFs (multi-page) vs images
+    ext = os.path.splitext(filename)[1].lower()
+    result_payload: Dict[str, Any] = {"run_id": run_id, "source": filename}
+
+    if ext == ".pdf":
+        num_pages = utils.count_pdf_pages(upload_path)
+        if not num_pages:
+            raise HTTPException(status_code=400, detail="Failed to convert PDF to images")
+
+        pages = []
+        decode_stats = demo_page.DecodeStats()
+        report(0, num_pages, "recognizing")
+        # Pages stream through rasterize -> layout -> element stages; only a few are in memory
+        for idx, pil_image, recognition_results in demo_page.iter_pdf_page_results(
+            upload_path, model, run_dir, max_batch_size=max_batch_size,
+            prefetch=PIPELINE_PREFETCH, batch_pages=ELEMENT_BATCH_PAGES,
+            max_batch_area=ELEMENT_BATCH_AREA, stats=decode_stats,
+        ):
+            page_name = f"{os.path.splitext(filename)[0]}_page_{idx+1:03d}"
+            # Render overlay
+            overlay_name = f"{page_name}_overlay.png"
             overlay_path = os.path.join(STATIC_DIR, overlay_name)
             render_overlay(pil_image, recognition_results, overlay_path)
 
+            # Map to client schema
             items = [
                 {
                     "order": r.get("reading_order", i+1),
@@ -174,15 +167,115 @@ async def process_document(file: UploadFile = File(...), max_batch_size: int = 1
                 for i, r in enumerate(recognition_results)
             ]
 
-            return {
-                "type": "image",
-                "run_id": run_id,
-                "source": filename,
+            pages.append({
+                "page": idx+1,
                 "items": items,
                 "overlay_url": f"/static/{overlay_name}",
-                "json_path": json_path or "",
+                "json_path": ""
+            })
+            report(idx + 1, num_pages, "recognizing")
+
+        # Save combined JSON/markdown
+        report(num_pages, num_pages, "saving")
+        combined_json_path = utils.save_combined_pdf_results(
+            [{"page_number": p["page"], "elements": [
+                {"label": it["type"], "bbox": it["bbox"], "text": it.get("text",""), "reading_order": it["order"]}
+             for it in p["items"]]} for p in pages],
+            upload_path,
+            run_dir
+        )
+        # Manifest lets the RAG indexer find this run's outputs without rescanning
+        write_run_manifest(run_dir, [(combined_json_path, len(pages))], source=filename)
+        print(f"{run_id}: {decode_stats.summary()}")
+        result_payload.update({
+            "type": "pdf", "pages": pages, "combined_json": combined_json_path,
+            "element_decoding": decode_stats.as_dict(),
+        })
+        return result_payload
+    else:
+        # Single image flow
+        report(0, 1, "recognizing")
+        pil_image = Image.open(upload_path).convert("RGB")
+        base_name = os.path.splitext(filename)[0]
+        json_path, recognition_results = demo_page.process_single_image(
+            pil_image, model, run_dir, base_name, max_batch_size=max_batch_size, save_individual=True,
+            max_batch_area=ELEMENT_BATCH_AREA,
+        )
+        overlay_name = f"{base_name}_overlay.png"
+        overlay_path = os.path.join(STATIC_DIR, overlay_name)
+        render_overlay(pil_image, recognition_results, overlay_path)
+        write_run_manifest(run_dir, [(json_path, 1)], source=filename)
+        report(1, 1, "done")
+
+        items = [
+            {
+                "order": r.get("reading_order", i+1),
+                "type": r.get("label", "paragraph"),
+                "bbox": r.get("bbox", [0,0,0,0]),
+                "text": r.get("text", ""),
             }
+            for i, r in enumerate(recognition_results)
+        ]
+
+        return {
+            "type": "image",
+            "run_id": run_id,
+            "source": filename,
+            "items": items,
+            "overlay_url": f"/static/{overlay_name}",
+            "json_path": json_path or "",
+        }
+
+
+@app.post("/api/process")
+async def process_document(file: UploadFile = File(...), max_batch_size: int = 16, model_path: str = DEFAULT_MODEL_PATH):
+    try:
+        run = await _save_upload(file)
+        # Same worker pool as /api/jobs, so concurrent uploads never exceed PROCESS_WORKERS inferences
+        future = JOBS.run(
+            lambda progress: _process_upload(run, max_batch_size, model_path, progress),
+            run_id=run["run_id"],
+            source=run["filename"],
+        )
+        return await asyncio.wrap_future(future)
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/jobs")
+async def submit_job(file: UploadFile = File(...), max_batch_size: int = 16, model_path: str = DEFAULT_MODEL_PATH):
+    """Queue a document for processing and return its job id immediately."""
+    run = await _save_upload(file)
+    job_id = JOBS.submit(
+        lambda progress: _process_upload(run, max_batch_size, model_path, progress),
+        run_id=run["run_id"],
+        source=run["filename"],
+    )
+    return {"job_id": job_id, "status": "queued", "run_id": run["run_id"], "status_url": f"/api/jobs/{job_id}"}
+
+
+@app.get("/api/jobs")
+def list_jobs():
+    return {"jobs": JOBS.list_jobs()}
+
+
+@app.get("/api/jobs/{job_id}")
+def job_status(job_id: str):
+    status = JOBS.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return status
+
+
+@app.get("/api/jobs/{job_id}/result")
+def job_result(job_id: str):
+    status = JOBS.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    if status["status"] == "failed":
+        raise HTTPException(status_code=500, detail=status["error"])
+    if status["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {status['status']}")
+    return JOBS.result(job_id)
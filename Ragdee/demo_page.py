@@ -5,7 +5,11 @@ SPDX-License-Identifier: MIT
 
 import argparse
 import glob
+import math
 import os
+import queue
+import threading
+from collections import OrderedDict
 
 import cv2
 import torch
@@ -14,6 +18,16 @@ from transformers import AutoProcessor, VisionEncoderDecoderModel
 
 from utils.utils import *
 
+LAYOUT_PROMPT = "Parse the reading order of this document."
+# Max total crop area (pixels) decoded in one element batch; large crops get smaller batches
+DEFAULT_BATCH_AREA = 4_000_000
+TEXT_PROMPT = "Read text in the image."
+ELEMENT_PROMPTS = {
+    "tab": "Parse the table in the image.",
+    "equ": "Read formula in the image.",
+    "code": "Read code in the image.",
+}
+
 
 class DOLPHIN:
     def __init__(self, model_id_or_path):
@@ -101,30 +115,24 @@ class DOLPHIN:
         return results
 
 
-def process_document(document_path, model, save_dir, max_batch_size=None):
+def process_document(
+    document_path, model, save_dir, max_batch_size=None, prefetch=2, batch_pages=4, max_batch_area=DEFAULT_BATCH_AREA,
+):
     """Parse documents with two stages - Handles both images and PDFs"""
     file_ext = os.path.splitext(document_path)[1].lower()
     
     if file_ext == '.pdf':
-        # Convert PDF to images
-        images = convert_pdf_to_images(document_path)
-        if not images:
+        num_pages = count_pdf_pages(document_path)
+        if not num_pages:
             raise Exception(f"Failed to convert PDF {document_path} to images")
         
         all_results = []
         
-        # Process each page
-        for page_idx, pil_image in enumerate(images):
-            print(f"Processing page {page_idx + 1}/{len(images)}")
-            
-            # Generate output name for this page
-            base_name = os.path.splitext(os.path.basename(document_path))[0]
-            page_name = f"{base_name}_page_{page_idx + 1:03d}"
-            
-            # Process this page (don't save individual page results)
-            json_path, recognition_results = process_single_image(
-                pil_image, model, save_dir, page_name, max_batch_size, save_individual=False
-            )
+        # Pages stream through rasterize -> layout -> element stages
+        for page_idx, pil_image, recognition_results in iter_pdf_page_results(
+            document_path, model, save_dir, max_batch_size, prefetch, batch_pages, max_batch_area
+        ):
+            print(f"Processed page {page_idx + 1}/{num_pages}")
             
             # Add page information to results
             page_results = {
@@ -142,10 +150,121 @@ def process_document(document_path, model, save_dir, max_batch_size=None):
         # Process regular image file
         pil_image = Image.open(document_path).convert("RGB")
         base_name = os.path.splitext(os.path.basename(document_path))[0]
-        return process_single_image(pil_image, model, save_dir, base_name, max_batch_size)
+        return process_single_image(
+            pil_image, model, save_dir, base_name, max_batch_size, max_batch_area=max_batch_area
+        )
+
+
+def iter_pdf_page_results(
+    pdf_path, model, save_dir, max_batch_size=None, prefetch=2, batch_pages=4,
+    max_batch_area=DEFAULT_BATCH_AREA, stats=None,
+):
+    """Parse PDF pages as a three-stage pipeline
+    
+    Page N+1 is rasterized while layout runs on page N and elements of page N-1
+    are decoded. Stages are connected by queues holding at most `prefetch` pages,
+    so only a few pages are in memory at once. Element crops of up to
+    `batch_pages` pages are decoded together (see ElementScheduler).
+    
+    Args:
+        pdf_path: Path to PDF file
+        model: DOLPHIN model instance
+        save_dir: Directory to save figures
+        max_batch_size: Maximum batch size for element decoding
+        prefetch: Pages buffered between consecutive stages
+        batch_pages: Pages whose elements may wait to fill a batch
+        max_batch_area: Max total crop area per element batch
+        stats: DecodeStats to record padding waste in (a new one is printed if None)
+        
+    Yields:
+        (page_idx, pil_image, recognition_results) in page order
+    """
+    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    prefetch = max(1, prefetch or 1)
+    stop = threading.Event()
+    pages = queue.Queue(maxsize=prefetch)
+    layouts = queue.Queue(maxsize=prefetch)
+
+    def layout(page):
+        page_idx, pil_image = page
+        return page_idx, pil_image, model.chat(LAYOUT_PROMPT, pil_image)
+
+    stages = [
+        threading.Thread(
+            target=_pipeline_stage, args=(enumerate(iter_pdf_images(pdf_path)), None, pages, stop),
+            name="pdf-rasterize", daemon=True,
+        ),
+        threading.Thread(
+            target=_pipeline_stage, args=(_pipeline_drain(pages, stop), layout, layouts, stop),
+            name="pdf-layout", daemon=True,
+        ),
+    ]
+    for stage in stages:
+        stage.start()
+    try:
+        # Element decoding runs in the caller's thread
+        scheduler = ElementScheduler(model, max_batch_size, max_batch_area, stats)
+        for page_idx, pil_image, layout_output in _pipeline_drain(layouts, stop):
+            page_name = f"{base_name}_page_{page_idx + 1:03d}"
+            padded_image, dims = prepare_image(pil_image)
+            scheduler.add_page(page_idx, layout_output, padded_image, dims, save_dir, page_name, payload=pil_image)
+            completed = scheduler.pop_completed()
+            # Partial batches wait for more pages, but only up to batch_pages pages
+            if scheduler.pending_pages >= max(1, batch_pages or 1):
+                completed += scheduler.flush()
+            yield from completed
+        yield from scheduler.flush()
+        if stats is None:
+            print(scheduler.stats.summary())
+    finally:
+        # Also reached when the consumer stops early or a stage failed
+        stop.set()
+        for stage in stages:
+            stage.join()
+
+
+def _pipeline_put(q, item, stop):
+    """Blocking put that gives up once the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
 
 
-def process_single_image(image, model, save_dir, image_name, max_batch_size=None, save_individual=True):
+def _pipeline_drain(q, stop):
+    """Yield a stage's outputs until it ends; re-raise its error in the consumer"""
+    while not stop.is_set():
+        try:
+            kind, value = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if kind == "end":
+            return
+        if kind == "error":
+            raise value
+        yield value
+
+
+def _pipeline_stage(source, fn, out, stop):
+    """Run fn over source items (identity if None) and feed the results to `out`"""
+    try:
+        for item in source:
+            if stop.is_set():
+                return
+            if not _pipeline_put(out, ("item", fn(item) if fn else item), stop):
+                return
+    except Exception as e:
+        _pipeline_put(out, ("error", e), stop)
+        return
+    _pipeline_put(out, ("end", None), stop)
+
+
+def process_single_image(
+    image, model, save_dir, image_name, max_batch_size=None, save_individual=True, max_batch_area=DEFAULT_BATCH_AREA,
+):
     """Process a single image (either from file or converted from PDF page)
     
     Args:
@@ -155,16 +274,19 @@ def process_single_image(image, model, save_dir, image_name, max_batch_size=None
         image_name: Name for the output file
         max_batch_size: Maximum batch size for processing
         save_individual: Whether to save individual results (False for PDF pages)
+        max_batch_area: Max total crop area per element batch; 0 disables
         
     Returns:
         Tuple of (json_path, recognition_results)
     """
     # Stage 1: Page-level layout and reading order parsing
-    layout_output = model.chat("Parse the reading order of this document.", image)
+    layout_output = model.chat(LAYOUT_PROMPT, image)
 
     # Stage 2: Element-level content parsing
     padded_image, dims = prepare_image(image)
-    recognition_results = process_elements(layout_output, padded_image, dims, model, max_batch_size, save_dir, image_name)
+    recognition_results = process_elements(
+        layout_output, padded_image, dims, model, max_batch_size, save_dir, image_name, max_batch_area
+    )
 
     # Save outputs only if requested (skip for PDF pages)
     json_path = None
@@ -176,19 +298,34 @@ def process_single_image(image, model, save_dir, image_name, max_batch_size=None
     return json_path, recognition_results
 
 
-def process_elements(layout_results, padded_image, dims, model, max_batch_size, save_dir=None, image_name=None):
+def process_elements(
+    layout_results, padded_image, dims, model, max_batch_size, save_dir=None, image_name=None,
+    max_batch_area=DEFAULT_BATCH_AREA,
+):
     """Parse all document elements with parallel decoding"""
+    scheduler = ElementScheduler(model, max_batch_size, max_batch_area)
+    scheduler.add_page(image_name, layout_results, padded_image, dims, save_dir, image_name)
+    [(_, _, recognition_results)] = scheduler.flush()
+    return recognition_results
+
+
+def collect_elements(layout_results, padded_image, dims, save_dir=None, image_name=None):
+    """Crop the elements of one page out of its layout output
+    
+    Figures are saved right away; every other element keeps its crop and the
+    prompt it is decoded with.
+    
+    Returns:
+        Tuple of (figure_results, elements)
+    """
     layout_results = parse_layout_string(layout_results)
 
-    tab_elements = []      
-    equ_elements = []     
-    code_elements = []    
-    text_elements = []     
-    figure_results = []    
+    elements = []
+    figure_results = []
     previous_box = None
     reading_order = 0
 
-    # Collect elements and group
+    # Collect elements
     for bbox, label in layout_results:
         try:
             x1, y1, x2, y2, orig_x1, orig_y1, orig_x2, orig_y2, previous_box = process_coordinates(
@@ -210,21 +347,13 @@ def process_elements(layout_results, padded_image, dims, model, max_batch_size,
                     })
                 else:
                     # Prepare element information
-                    element_info = {
+                    elements.append({
                         "crop": pil_crop,
                         "label": label,
                         "bbox": [orig_x1, orig_y1, orig_x2, orig_y2],
                         "reading_order": reading_order,
-                    }
-                    
-                    if label == "tab":
-                        tab_elements.append(element_info)
-                    elif label == "equ":
-                        equ_elements.append(element_info)
-                    elif label == "code":
-                        code_elements.append(element_info)
-                    else:
-                        text_elements.append(element_info)
+                        "prompt": ELEMENT_PROMPTS.get(label, TEXT_PROMPT),
+                    })
 
             reading_order += 1
 
@@ -232,62 +361,213 @@ def process_elements(layout_results, padded_image, dims, model, max_batch_size,
             print(f"Error processing bbox with label {label}: {str(e)}")
             continue
 
-    recognition_results = figure_results.copy()
+    return figure_results, elements
+
+
+def element_size_key(crop):
+    """Sort key of a crop by expected decoded length: size class, then shape, then area
     
-    if tab_elements:
-        results = process_element_batch(tab_elements, model, "Parse the table in the image.", max_batch_size)
-        recognition_results.extend(results)
+    Size class is floor(log2(area)); shape is 0 for line-like crops (width >= 4x
+    height), 1 for blocks, 2 for tall crops.
+    """
+    width, height = crop.size
+    area = max(1, width * height)
+    ratio = width / max(1, height)
+    shape = 0 if ratio >= 4 else (1 if ratio >= 1 else 2)
+    return int(math.log2(area)), shape, area
+
+
+def plan_batches(crops, max_batch_size=None, max_batch_area=DEFAULT_BATCH_AREA):
+    """Split crops into batches of similar size, largest first
     
-    if equ_elements:
-        results = process_element_batch(equ_elements, model, "Read formula in the image.", max_batch_size)
-        recognition_results.extend(results)
+    Crops are sorted by element_size_key and cut into consecutive batches, so each
+    batch holds neighbours in (size class, shape, area) order and only the last one
+    is partial. A batch can span adjacent size classes when a class alone would not
+    fill it, which keeps batches full for the scheduler. Each batch holds up to
+    max_batch_size crops, fewer for large crops so that batch size x its largest
+    crop area stays under max_batch_area.
     
-    if code_elements:
-        results = process_element_batch(code_elements, model, "Read code in the image.", max_batch_size)
-        recognition_results.extend(results)
+    Returns:
+        List of (indices into crops, full) where full means the batch hit its size limit
+    """
+    keys = [element_size_key(crop) for crop in crops]
+    order = sorted(range(len(crops)), key=keys.__getitem__, reverse=True)
+    batches = []
+    start = 0
+    while start < len(order):
+        # None = no limit; such a batch takes everything left and is never "full"
+        limit = max_batch_size if max_batch_size is not None and max_batch_size > 0 else None
+        if max_batch_area and max_batch_area > 0:
+            width, height = crops[order[start]].size
+            by_area = max(1, int(max_batch_area // max(1, width * height)))
+            limit = by_area if limit is None else min(limit, by_area)
+        batch = order[start:start + limit] if limit else order[start:]
+        batches.append((batch, limit is not None and len(batch) == limit))
+        start += len(batch)
+    return batches
+
+
+class DecodeStats:
+    """Padding waste of batched element decoding
     
-    if text_elements:
-        results = process_element_batch(text_elements, model, "Read text in the image.", max_batch_size)
-        recognition_results.extend(results)
+    Greedy generation runs every sequence of a batch until the longest one ends;
+    waste is the share of those decoding steps spent after a sequence finished.
+    """
 
-    recognition_results.sort(key=lambda x: x.get("reading_order", 0))
+    def __init__(self):
+        self.batches = 0
+        self.elements = 0
+        self.tokens = 0          # tokens actually produced
+        self.padded_tokens = 0   # batch size x longest output, summed over batches
+
+    def add_batch(self, lengths):
+        if not lengths:
+            return
+        self.batches += 1
+        self.elements += len(lengths)
+        self.tokens += sum(lengths)
+        self.padded_tokens += len(lengths) * max(lengths)
+
+    @property
+    def padding_waste(self):
+        return 1 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+    def as_dict(self):
+        return {
+            "batches": self.batches,
+            "elements": self.elements,
+            "tokens": self.tokens,
+            "padded_tokens": self.padded_tokens,
+            "padding_waste": round(self.padding_waste, 4),
+        }
+
+    def summary(self):
+        avg = self.elements / self.batches if self.batches else 0
+        return (
+            f"Element decoding: {self.elements} elements in {self.batches} batches "
+            f"(avg {avg:.1f}), padding waste {self.padding_waste:.1%}"
+        )
 
-    return recognition_results
 
+class ElementScheduler:
+    """Batch element decoding across pages
+    
+    Crops of every added page are queued per prompt type. Whenever a queue holds
+    enough similar-sized crops for a full batch (plan_batches), that batch goes
+    through DOLPHIN.chat; the rest wait for more pages or the final flush.
+    Results are scattered back to their pages, which are released in the order
+    they were added with their elements in reading order.
+    """
 
-def process_element_batch(elements, model, prompt, max_batch_size=None):
-    """Process elements of the same type in batches"""
-    results = []
+    def __init__(self, model, max_batch_size=None, max_batch_area=DEFAULT_BATCH_AREA, stats=None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_batch_area = max_batch_area
+        self.stats = stats if stats is not None else DecodeStats()
+        self._queues = {}             # prompt -> [(page_key, element), ...]
+        self._pages = OrderedDict()   # page_key -> {"payload", "results", "pending"}
+
+    @property
+    def pending_pages(self):
+        """Pages added but not yet released"""
+        return len(self._pages)
+
+    def add_page(self, page_key, layout_results, padded_image, dims, save_dir=None, image_name=None, payload=None):
+        """Queue the elements of one page and decode any batches that are now full
+        
+        Args:
+            page_key: Unique key of the page, returned with its results
+            payload: Anything to hand back with the page's results (e.g. its image)
+        """
+        figure_results, elements = collect_elements(layout_results, padded_image, dims, save_dir, image_name)
+        self._pages[page_key] = {"payload": payload, "results": figure_results, "pending": len(elements)}
+        for elem in elements:
+            self._queues.setdefault(elem["prompt"], []).append((page_key, elem))
+        self._run(full_only=True)
+
+    def pop_completed(self):
+        """Release finished pages, in add order, up to the first unfinished one
+        
+        Returns:
+            List of (page_key, payload, recognition_results)
+        """
+        completed = []
+        while self._pages:
+            page_key, page = next(iter(self._pages.items()))
+            if page["pending"]:
+                break
+            self._pages.popitem(last=False)
+            page["results"].sort(key=lambda x: x.get("reading_order", 0))
+            completed.append((page_key, page["payload"], page["results"]))
+        return completed
+
+    def flush(self):
+        """Decode everything still queued, partial batches included, and release all pages"""
+        self._run(full_only=False)
+        return self.pop_completed()
+
+    def _run(self, full_only):
+        for prompt, pending in self._queues.items():
+            if not pending:
+                continue
+            batches = plan_batches([elem["crop"] for _, elem in pending], self.max_batch_size, self.max_batch_area)
+            taken = set()
+            for indices, full in batches:
+                if full_only and not full:
+                    continue
+                batch = [pending[i] for i in indices]
+                taken.update(indices)
+                results = process_element_batch(
+                    [elem for _, elem in batch], self.model, prompt, len(batch), self.max_batch_area, self.stats
+                )
+                for (page_key, _), result in zip(batch, results):
+                    page = self._pages[page_key]
+                    page["results"].append(result)
+                    page["pending"] -= 1
+            pending[:] = [entry for i, entry in enumerate(pending) if i not in taken]
+
+
+def process_element_batch(elements, model, prompt, max_batch_size=None, max_batch_area=DEFAULT_BATCH_AREA, stats=None):
+    """Process elements of the same type in batches
     
-    # Determine batch size
-    batch_size = len(elements)
-    if max_batch_size is not None and max_batch_size > 0:
-        batch_size = min(batch_size, max_batch_size)
+    Batches group crops of similar size and shape (plan_batches). Results come
+    back in the order of `elements`; padding waste is recorded in `stats` when given.
+    """
+    results = [None] * len(elements)
     
     # Process in batches
-    for i in range(0, len(elements), batch_size):
-        batch_elements = elements[i:i+batch_size]
-        crops_list = [elem["crop"] for elem in batch_elements]
+    for batch_indices, _ in plan_batches([elem["crop"] for elem in elements], max_batch_size, max_batch_area):
+        crops_list = [elements[i]["crop"] for i in batch_indices]
         
         # Use the same prompt for all elements in the batch
         prompts_list = [prompt] * len(crops_list)
         
         # Batch inference
         batch_results = model.chat(prompts_list, crops_list)
+        if stats is not None:
+            stats.add_batch(_output_lengths(model, batch_results))
         
         # Add results
-        for j, result in enumerate(batch_results):
-            elem = batch_elements[j]
-            results.append({
+        for i, result in zip(batch_indices, batch_results):
+            elem = elements[i]
+            results[i] = {
                 "label": elem["label"],
                 "bbox": elem["bbox"],
                 "text": result.strip(),
                 "reading_order": elem["reading_order"],
-            })
+            }
     
     return results
 
 
+def _output_lengths(model, texts):
+    """Decoded lengths in tokens (characters if the model has no tokenizer)"""
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        return [len(text) for text in texts]
+    return [len(ids) + 1 for ids in tokenizer(texts, add_special_tokens=False).input_ids]
+
+
 def main():
     parser = argparse.ArgumentParser(description="Document parsing based on DOLPHIN")
     parser.add_argument("--model_path", default="./hf_model", help="Path to Hugging Face model")
@@ -304,6 +584,24 @@ def main():
         default=16,
         help="Maximum number of document elements to parse in a single batch (default: 16)",
     )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="PDF pages buffered between the rasterize, layout and element stages (default: 2)",
+    )
+    parser.add_argument(
+        "--batch_pages",
+        type=int,
+        default=4,
+        help="PDF pages whose elements are batched together for decoding (default: 4)",
+    )
+    parser.add_argument(
+        "--max_batch_area",
+        type=int,
+        default=DEFAULT_BATCH_AREA,
+        help=f"Max total crop area in pixels per element batch; 0 disables (default: {DEFAULT_BATCH_AREA})",
+    )
     args = parser.parse_args()
 
     # Load Model
@@ -348,6 +646,9 @@ def main():
                 model=model,
                 save_dir=save_dir,
                 max_batch_size=args.max_batch_size,
+                prefetch=args.prefetch,
+                batch_pages=args.batch_pages,
+                max_batch_area=args.max_batch_area,
             )
 
             print(f"Processing completed. Results saved to {save_dir}")
@@ -0,0 +1,136 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    return _WS_RE.sub(" ", question).strip().lower()
+
+
+class AnswerCache:
+    """
+    Two-tier cache of query results.
+
+    - Exact tier: keyed on (normalized question, index version, retrieval params); a hit
+      skips both the query embedding and the completion.
+    - Semantic tier: previous query embeddings in one matrix; a new question whose
+      embedding has cosine >= threshold with a cached one (same version and params)
+      reuses that answer and skips the completion.
+    Both tiers use TTL expiry and LRU eviction, and are dropped wholesale when the
+    index version changes.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        similarity_threshold: Optional[float] = None,
+    ) -> None:
+        self.max_entries = max_entries or int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+        self.similarity_threshold = (
+            similarity_threshold if similarity_threshold is not None
+            else float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+        )
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        # exact tier: key -> (expires_at, result)
+        self._exact: "OrderedDict[Hashable, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # semantic tier: fixed-capacity matrix of normalized query vectors plus per-slot metadata
+        self._vectors: Optional[np.ndarray] = None
+        self._slot_params: list = [None] * self.max_entries
+        self._slot_results: list = [None] * self.max_entries
+        self._slot_expires = np.zeros(self.max_entries, dtype=np.float64)
+        self._slot_used = np.zeros(self.max_entries, dtype=np.float64)
+        self._slots_filled = 0
+
+    def exact_key(self, question: str, params: Hashable) -> Tuple[str, Hashable]:
+        return normalize_question(question), params
+
+    def get_exact(self, version: int, key: Hashable) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._check_version(version)
+            entry = self._exact.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._exact[key]
+                return None
+            self._exact.move_to_end(key)
+            return entry[1]
+
+    def get_similar(self, version: int, params: Hashable, q_vec: np.ndarray) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._check_version(version)
+            n = self._slots_filled
+            if n == 0 or self._vectors is None or self._vectors.shape[1] != q_vec.shape[0]:
+                return None
+            now = time.monotonic()
+            sims = self._vectors[:n] @ q_vec
+            sims[self._slot_expires[:n] < now] = -np.inf
+            for slot in np.argsort(-sims).tolist():
+                if sims[slot] < self.similarity_threshold:
+                    return None
+                if self._slot_params[slot] == params:
+                    self._slot_used[slot] = now
+                    return self._slot_results[slot]
+            return None
+
+    def put(self, version: int, key: Hashable, params: Hashable, q_vec: Optional[np.ndarray], result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._check_version(version)
+            now = time.monotonic()
+            expires = now + self.ttl_seconds
+            self._exact[key] = (expires, result)
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+
+            if q_vec is None:
+                return
+            if self._vectors is None or self._vectors.shape[1] != q_vec.shape[0]:
+                self._vectors = np.zeros((self.max_entries, q_vec.shape[0]), dtype=np.float32)
+                self._slots_filled = 0
+            if self._slots_filled < self.max_entries:
+                slot = self._slots_filled
+                self._slots_filled += 1
+            else:
+                # Evict the least recently used (expired slots have the oldest use times anyway)
+                slot = int(np.argmin(self._slot_used))
+            self._vectors[slot] = q_vec
+            self._slot_params[slot] = params
+            self._slot_results[slot] = result
+            self._slot_expires[slot] = expires
+            self._slot_used[slot] = now
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _check_version(self, version: int) -> None:
+        if version != self._version:
+            self._clear()
+            self._version = version
+
+    def _clear(self) -> None:
+        self._exact.clear()
+        self._slots_filled = 0
+        self._slot_params = [None] * self.max_entries
+        self._slot_results = [None] * self.max_entries
+        self._slot_expires[:] = 0
+        self._slot_used[:] = 0
+
+
+def make_answer_cache() -> Optional[AnswerCache]:
+    """ANSWER_CACHE=off disables answer caching."""
+    if os.getenv("ANSWER_CACHE", "on").lower() in ("0", "off", "false", "no"):
+        return None
+    return AnswerCache()
@@ -0,0 +1,186 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# (text, page, line, ordinal of the item inside its source JSON)
+ChunkRecord = Tuple[str, int, int, int]
+MetaLoader = Callable[[str], Sequence[Any]]
+
+
+class SourceChunk:
+    """
+    Lightweight view of one indexed chunk.
+
+    `meta` (the raw recognition item) is not kept in memory; it is re-read from the
+    source JSON on first access.
+    """
+
+    __slots__ = ("index", "text", "page", "line", "source", "_store", "_meta")
+
+    def __init__(
+        self,
+        text: str,
+        page: int,
+        line: int,
+        meta: Optional[Dict[str, Any]] = None,
+        source: str = "",
+        index: int = -1,
+        store: Optional["ChunkStore"] = None,
+    ) -> None:
+        self.index = index
+        self.text = text
+        self.page = page
+        self.line = line
+        self.source = source
+        self._store = store
+        self._meta = meta
+
+    @property
+    def meta(self) -> Any:
+        if self._meta is None:
+            self._meta = self._store.meta(self.index) if self._store is not None else {}
+        return self._meta
+
+    def __repr__(self) -> str:
+        return f"SourceChunk(page={self.page}, line={self.line}, text={self.text[:40]!r})"
+
+
+class ChunkStore:
+    """
+    Columnar storage for indexed chunks.
+
+    - page/line/source/ordinal live in int32 NumPy columns.
+    - Texts are a plain list of interned strings (repeated headers/footers share one object).
+    - Item metadata is referenced by (source, ordinal) and loaded lazily through `meta_loader`.
+    Indexing (`store[i]`) and iteration yield SourceChunk views.
+    """
+
+    _META_CACHE_FILES = 4
+
+    def __init__(self, meta_loader: Optional[MetaLoader] = None) -> None:
+        self.meta_loader = meta_loader
+        self.sources: List[str] = []
+        self._source_pos: Dict[str, int] = {}
+        self.texts: List[str] = []
+        self.pages = np.zeros(0, dtype=np.int32)
+        self.lines = np.zeros(0, dtype=np.int32)
+        self.source_ids = np.zeros(0, dtype=np.int32)
+        self.ordinals = np.zeros(0, dtype=np.int32)
+        self._meta_cache: "OrderedDict[str, Sequence[Any]]" = OrderedDict()
+        self._meta_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, i: int) -> SourceChunk:
+        sid = int(self.source_ids[i])
+        return SourceChunk(
+            text=self.texts[i],
+            page=int(self.pages[i]),
+            line=int(self.lines[i]),
+            source=self.sources[sid] if sid >= 0 else "",
+            index=i,
+            store=self,
+        )
+
+    def __iter__(self) -> Iterator[SourceChunk]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def source_id(self, path: str) -> int:
+        pos = self._source_pos.get(path)
+        if pos is None:
+            pos = len(self.sources)
+            self.sources.append(path)
+            self._source_pos[path] = pos
+        return pos
+
+    def clear(self) -> None:
+        self.__init__(self.meta_loader)
+
+    def extend(self, source: str, records: Sequence[ChunkRecord]) -> None:
+        if not records:
+            return
+        sid = self.source_id(source)
+        texts, pages, lines, ordinals = zip(*records)
+        self.texts.extend(sys.intern(t) for t in texts)
+        self.pages = np.concatenate([self.pages, np.asarray(pages, dtype=np.int32)])
+        self.lines = np.concatenate([self.lines, np.asarray(lines, dtype=np.int32)])
+        self.source_ids = np.concatenate([self.source_ids, np.full(len(records), sid, dtype=np.int32)])
+        self.ordinals = np.concatenate([self.ordinals, np.asarray(ordinals, dtype=np.int32)])
+
+    def copy(self) -> "ChunkStore":
+        """
+        Copy for copy-on-write updates: lists are copied, NumPy columns are shared
+        (extend/compact replace them instead of writing into them).
+        """
+        other = ChunkStore(self.meta_loader)
+        other.sources = list(self.sources)
+        other._source_pos = dict(self._source_pos)
+        other.texts = list(self.texts)
+        other.pages = self.pages
+        other.lines = self.lines
+        other.source_ids = self.source_ids
+        other.ordinals = self.ordinals
+        return other
+
+    def compact(self, keep: np.ndarray) -> None:
+        """Keep only rows where keep is True (row order preserved)."""
+        self.texts = [t for t, k in zip(self.texts, keep.tolist()) if k]
+        self.pages = self.pages[keep]
+        self.lines = self.lines[keep]
+        self.source_ids = self.source_ids[keep]
+        self.ordinals = self.ordinals[keep]
+        self._meta_cache.clear()
+
+    def load_columns(
+        self,
+        sources: List[str],
+        texts: List[str],
+        pages: np.ndarray,
+        lines: np.ndarray,
+        source_ids: np.ndarray,
+        ordinals: np.ndarray,
+    ) -> None:
+        self.clear()
+        for path in sources:
+            self.source_id(path)
+        self.texts = [sys.intern(t) for t in texts]
+        self.pages = np.asarray(pages, dtype=np.int32)
+        self.lines = np.asarray(lines, dtype=np.int32)
+        self.source_ids = np.asarray(source_ids, dtype=np.int32)
+        self.ordinals = np.asarray(ordinals, dtype=np.int32)
+
+    def rows_of_sources(self, paths: Sequence[str]) -> np.ndarray:
+        """Boolean mask of rows that came from any of `paths`."""
+        ids = [self._source_pos[p] for p in paths if p in self._source_pos]
+        return np.isin(self.source_ids, np.asarray(ids, dtype=np.int32))
+
+    def meta(self, i: int) -> Any:
+        """The raw recognition item of row i, or {} if its source is gone."""
+        sid = int(self.source_ids[i])
+        if sid < 0 or self.meta_loader is None:
+            return {}
+        path = self.sources[sid]
+        with self._meta_lock:
+            items = self._meta_cache.get(path)
+            if items is None:
+                try:
+                    items = self.meta_loader(path)
+                except Exception:
+                    items = []
+                self._meta_cache[path] = items
+                if len(self._meta_cache) > self._META_CACHE_FILES:
+                    self._meta_cache.popitem(last=False)
+            else:
+                self._meta_cache.move_to_end(path)
+        ordinal = int(self.ordinals[i])
+        return items[ordinal] if 0 <= ordinal < len(items) else {}
+
+    def nbytes(self) -> int:
+        text_bytes = sum(sys.getsizeof(t) for t in self.texts) + 8 * len(self.texts)
+        return text_bytes + self.pages.nbytes + self.lines.nbytes + self.source_ids.nbytes + self.ordinals.nbytes
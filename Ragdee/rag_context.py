@@ -0,0 +1,89 @@
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+from rag_embeddings import estimate_tokens, text_key
+
+try:
+    import tiktoken  # optional: exact local token counts
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None  # type: ignore
+
+
+TokenCount = Callable[[str], int]
+
+# (dedupe text, rendered prompt line)
+ContextLine = Tuple[str, str]
+
+TRUNCATION_MARK = " [...]"
+
+
+def make_token_counter(model: Optional[str] = None) -> TokenCount:
+    """Local token counter: tiktoken for `model` when installed, else the conservative estimate_tokens."""
+    if tiktoken is None:
+        return estimate_tokens
+    try:
+        enc = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        try:
+            enc = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            return estimate_tokens
+    return lambda text: len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_to_budget(text: str, max_tokens: int, count: TokenCount) -> str:
+    """Longest prefix of text (plus TRUNCATION_MARK) with count(...) <= max_tokens; "" if none fits."""
+    if count(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count(text[:mid] + TRUNCATION_MARK) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + TRUNCATION_MARK if lo else ""
+
+
+def pack_context(
+    groups: Sequence[Sequence[ContextLine]],
+    weights: Sequence[float],
+    budget: int,
+    count: TokenCount,
+) -> List[List[Tuple[int, str]]]:
+    """
+    Choose which lines of each retrieval group go into the prompt.
+
+    - Groups are visited by descending weight; a group's first line (its seed) must
+      fit for the group to be kept, then its neighbors are added in order while they fit.
+    - The seed of the first group is cut to the budget instead of dropped, so a single
+      oversized chunk (e.g. a dense OCR table) is still cited.
+    - A line whose text was already packed, or is contained in a line of the same
+      group, is skipped (overlapping neighbors add tokens but no information).
+    Returns, per group, (position, rendered line) of the kept lines (empty = group dropped).
+    """
+    kept: List[List[Tuple[int, str]]] = [[] for _ in groups]
+    seen: Set[str] = set()
+    remaining = budget
+    for g in sorted(range(len(groups)), key=lambda i: weights[i], reverse=True):
+        group_texts: List[str] = []
+        for pos, (text, rendered) in enumerate(groups[g]):
+            key = text_key(text)
+            if key in seen or any(text in other for other in group_texts):
+                if pos == 0:
+                    break
+                continue
+            # +1 for the newline joining lines (and the blank line between groups)
+            cost = count(rendered) + 1
+            if cost > remaining:
+                if pos == 0 and not seen:
+                    rendered = truncate_to_budget(rendered, remaining - 1, count)
+                    cost = count(rendered) + 1
+                if not rendered or cost > remaining:
+                    if pos == 0:
+                        break
+                    continue
+            remaining -= cost
+            seen.add(key)
+            group_texts.append(text)
+            kept[g].append((pos, rendered))
+    return kept
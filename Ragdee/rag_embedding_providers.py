@@ -0,0 +1,207 @@
+import os
+import re
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag_embeddings import EmbeddingBatcher, ProgressCallback
+
+try:
+    from sentence_transformers import SentenceTransformer  # optional local encoder
+except Exception:  # pragma: no cover - optional dependency
+    SentenceTransformer = None  # type: ignore
+
+
+PROVIDERS = ("openai", "hashing", "local")
+
+# Loaded sentence-transformers models, shared by every provider (and so every index) using
+# them, each with the lock that serializes its encode calls
+_LOCAL_MODELS: Dict[Tuple[str, str], Tuple[Any, threading.Lock]] = {}
+_LOCAL_MODELS_LOCK = threading.Lock()
+
+
+def _load_local_model(model_path: str, backend: str) -> Tuple[Any, threading.Lock]:
+    """Load a sentence-transformers model once per process for each (path, backend)."""
+    key = (os.path.abspath(model_path) if os.path.exists(model_path) else model_path, backend)
+    with _LOCAL_MODELS_LOCK:
+        entry = _LOCAL_MODELS.get(key)
+        if entry is None:
+            model_kwargs = {"device": "cpu"}
+            if backend != "torch":
+                model_kwargs["backend"] = backend
+            entry = (SentenceTransformer(model_path, **model_kwargs), threading.Lock())
+            _LOCAL_MODELS[key] = entry
+        return entry
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into a float32 matrix, one row per input, in input order.
+
+    `name` identifies the vector space (model + dimensionality); it keys the
+    embedding cache and is recorded in snapshots, so vectors from different
+    providers are never mixed.
+    """
+
+    kind = ""
+    name = ""
+    # What make_embedding_provider needs to rebuild this provider (model name or path)
+    model_id: Optional[str] = None
+    dim: Optional[int] = None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI embeddings through EmbeddingBatcher (batched, concurrent, retried)."""
+
+    kind = "openai"
+
+    def __init__(self, client: Any, model: str, dim: Optional[int] = None, progress: Optional[ProgressCallback] = None) -> None:
+        self.model_id = model
+        self.dim = dim
+        # text-embedding-3 models can shorten vectors natively via `dimensions`
+        self.name = f"{model}@{dim}" if dim else model
+        self.batcher = EmbeddingBatcher(client, model, dimensions=dim, progress=progress)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.batcher.embed(texts)
+
+
+class _LocalEncoder(EmbeddingProvider):
+    """
+    Shared batching for in-process encoders: fixed-size batches, encoded one after another.
+
+    Batches are not run on a thread pool: torch already spreads one batch over its
+    intra-op threads, a shared HF fast tokenizer is not safe under concurrent calls,
+    and the hashing encoder is pure Python, so extra threads would only contend on the GIL.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, progress: Optional[ProgressCallback] = None) -> None:
+        self.batch_size = batch_size or int(os.getenv("LOCAL_EMBED_BATCH_SIZE", "64"))
+        self.progress = progress
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        out = None
+        for start in range(0, len(texts), self.batch_size):
+            end = min(start + self.batch_size, len(texts))
+            rows = self._encode_batch(texts[start:end])
+            if out is None:
+                out = np.empty((len(texts), rows.shape[1]), dtype=np.float32)
+            out[start:end] = rows
+            if self.progress and len(texts) > self.batch_size:
+                self.progress(end, len(texts))
+        return out
+
+    def _encode_batch(self, batch: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=1 << 16)
+def _feature(token: str, dim: int) -> int:
+    """Stable (process-independent) signed bucket for a token: sign in bit 0, bucket in the rest."""
+    h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+    return ((h >> 1) % dim) << 1 | (h & 1)
+
+
+class HashingEmbeddingProvider(_LocalEncoder):
+    """
+    Deterministic bag-of-features embeddings with no model and no network.
+
+    Word unigrams, word bigrams and character trigrams are hashed into `dim` signed
+    buckets and weighted by log(1 + tf). Useful for air-gapped deployments and
+    offline tests; quality is lexical, not semantic.
+    """
+
+    kind = "hashing"
+
+    def __init__(self, dim: Optional[int] = None, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.dim = dim or 384
+        self.name = f"hashing-{self.dim}"
+
+    def _encode_batch(self, batch: List[str]) -> np.ndarray:
+        out = np.zeros((len(batch), self.dim), dtype=np.float32)
+        for row, text in enumerate(batch):
+            words = _TOKEN_RE.findall(text.lower())
+            feats = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for w in words:
+                padded = f"#{w}#"
+                feats.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+            if not feats:
+                continue
+            codes = np.fromiter((_feature(f, self.dim) for f in feats), dtype=np.int64, count=len(feats))
+            out[row] = np.bincount(codes >> 1, weights=np.where(codes & 1, 1.0, -1.0), minlength=self.dim)
+        # Dampen repeated features: sign(x) * log(1 + |x|)
+        return np.sign(out) * np.log1p(np.abs(out))
+
+
+class LocalModelEmbeddingProvider(_LocalEncoder):
+    """
+    A sentence-transformers model loaded from a local path (or cached name), run on CPU.
+
+    LOCAL_EMBEDDING_BACKEND=onnx uses the ONNX Runtime backend where the installed
+    sentence-transformers version supports it. With `dim`, vectors are truncated to
+    the first `dim` components (suits Matryoshka-trained models).
+    """
+
+    kind = "local"
+
+    def __init__(self, model_path: str, dim: Optional[int] = None, **kwargs: Any) -> None:
+        if SentenceTransformer is None:
+            raise RuntimeError(
+                "Local embeddings need sentence-transformers. Install with `pip install sentence-transformers` "
+                "or use EMBEDDING_PROVIDER=hashing."
+            )
+        super().__init__(**kwargs)
+        backend = os.getenv("LOCAL_EMBEDDING_BACKEND", "torch").lower()
+        self.model_id = model_path
+        # Shared across services: /rag/init, named indexes and registry reloads reuse one copy
+        self.model, self._model_lock = _load_local_model(model_path, backend)
+        native = self.model.get_sentence_embedding_dimension()
+        self.dim = min(dim, native) if dim else native
+        self.name = f"local:{os.path.basename(os.path.normpath(model_path))}:{self.dim}"
+
+    def _encode_batch(self, batch: List[str]) -> np.ndarray:
+        # The model is shared by every service using it (query embedder threads included)
+        with self._model_lock:
+            vecs = self.model.encode(batch, batch_size=len(batch), convert_to_numpy=True, show_progress_bar=False)
+        return np.asarray(vecs[:, :self.dim], dtype=np.float32)
+
+
+def make_embedding_provider(
+    kind: Optional[str] = None,
+    client: Any = None,
+    model: Optional[str] = None,
+    dim: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> EmbeddingProvider:
+    """
+    Build the provider selected by EMBEDDING_PROVIDER (openai | hashing | local).
+
+    - openai: `model` (EMBEDDING_MODEL) via `client`
+    - hashing: no dependencies, deterministic
+    - local: sentence-transformers model at `model` or LOCAL_EMBEDDING_MODEL
+    EMBEDDING_DIM sets the output dimensionality for all three.
+    """
+    kind = (kind or os.getenv("EMBEDDING_PROVIDER", "openai")).lower()
+    dim = dim or int(os.getenv("EMBEDDING_DIM", "0")) or None
+    if kind == "openai":
+        return OpenAIEmbeddingProvider(client, model or os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"), dim, progress)
+    if kind == "hashing":
+        return HashingEmbeddingProvider(dim, progress=progress)
+    if kind == "local":
+        path = model or os.getenv("LOCAL_EMBEDDING_MODEL")
+        if not path:
+            raise RuntimeError("EMBEDDING_PROVIDER=local needs LOCAL_EMBEDDING_MODEL (path to a sentence-transformers model)")
+        return LocalModelEmbeddingProvider(path, dim, progress=progress)
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER: {kind!r} (expected {', '.join(PROVIDERS)})")
@@ -0,0 +1,317 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from queue import Empty, Queue
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+ProgressCallback = Callable[[int, int], None]
+
+
+_WS_RE = re.compile(r"\s+")
+
+
+def text_key(text: str) -> str:
+    """Content hash of whitespace-normalized text, used as the embedding cache key."""
+    normalized = _WS_RE.sub(" ", text).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Conservative token estimate without a tokenizer: ~3 ASCII characters per token
+    (English prose is ~4, digit/symbol-heavy OCR text less) and one token per
+    non-ASCII character (CJK and most accented or symbol characters take at least one).
+    """
+    if text.isascii():
+        return len(text) // 3 + 1
+    non_ascii = len(text) - len(text.encode("ascii", "ignore"))
+    return (len(text) - non_ascii) // 3 + non_ascii + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text so estimate_tokens(text) <= max_tokens (proportional cut, so CJK keeps fewer characters)."""
+    est = estimate_tokens(text)
+    while est > max_tokens and len(text) > 1:
+        text = text[: max(1, len(text) * max_tokens // est - 1)]
+        est = estimate_tokens(text)
+    return text
+
+
+class EmbeddingBatcher:
+    """
+    Splits texts into provider-sized batches and embeds them concurrently.
+
+    - Batches are bounded by item count and by an estimated token budget.
+    - Inputs longer than the per-input limit are truncated instead of failing the request.
+    - Batches run on a bounded thread pool; failed batches are retried with exponential backoff.
+    - `client` only needs `embeddings.create(model=..., input=[...])`, so a local fake works for tests.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        model: str,
+        max_items: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        max_input_tokens: Optional[int] = None,
+        max_workers: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff: float = 1.0,
+        progress: Optional[ProgressCallback] = None,
+        dimensions: Optional[int] = None,
+    ) -> None:
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.max_items = max_items or int(os.getenv("EMBED_BATCH_SIZE", "256"))
+        self.max_tokens = max_tokens or int(os.getenv("EMBED_BATCH_TOKENS", "100000"))
+        self.max_input_tokens = max_input_tokens or int(os.getenv("EMBED_MAX_INPUT_TOKENS", "8000"))
+        self.max_workers = max_workers or int(os.getenv("EMBED_WORKERS", "4"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("EMBED_MAX_RETRIES", "3"))
+        self.backoff = backoff
+        self.progress = progress
+
+    def plan_batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """Return [start, end) ranges covering texts, respecting item and token limits."""
+        batches: List[Tuple[int, int]] = []
+        start = 0
+        tokens = 0
+        for i, text in enumerate(texts):
+            t = min(estimate_tokens(text), self.max_input_tokens)
+            if i > start and (i - start >= self.max_items or tokens + t > self.max_tokens):
+                batches.append((start, i))
+                start, tokens = i, 0
+            tokens += t
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts and return a float32 matrix with one row per input, in input order."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        texts = [truncate_to_tokens(t, self.max_input_tokens) for t in texts]
+        batches = self.plan_batches(texts)
+        if len(batches) == 1:
+            # Common for queries and small updates: no thread pool round-trip
+            rows = self._embed_batch(texts)
+            if self.progress:
+                self.progress(len(texts), len(texts))
+            return np.asarray(rows, dtype=np.float32)
+        results: List[Optional[List[List[float]]]] = [None] * len(batches)
+        done = 0
+
+        workers = max(1, min(self.max_workers, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(self._embed_batch, texts[start:end]): (b, end - start)
+                for b, (start, end) in enumerate(batches)
+            }
+            for fut in as_completed(futures):
+                b, size = futures[fut]
+                results[b] = fut.result()
+                done += size
+                if self.progress:
+                    self.progress(done, len(texts))
+
+        rows = [row for batch in results for row in batch]
+        return np.asarray(rows, dtype=np.float32)
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+                resp = self.client.embeddings.create(model=self.model, input=batch, **kwargs)
+                return [d.embedding for d in resp.data]
+            except Exception:
+                if attempt >= self.max_retries:
+                    raise
+                # Exponential backoff with jitter to avoid synchronized retries across workers
+                time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+                attempt += 1
+
+
+class QueryEmbedder:
+    """
+    Embeds user questions with an in-process LRU and a micro-batcher.
+
+    - Repeated questions (same normalized text) are served from the LRU.
+    - Identical questions already in flight share one pending result.
+    - Distinct questions arriving within `window_ms` of each other are sent to the
+      embedding provider as a single batch by one background thread.
+    Vectors are returned as read-only float32 arrays shared with the cache.
+    """
+
+    def __init__(
+        self,
+        provider: Any,
+        cache_size: Optional[int] = None,
+        window_ms: Optional[float] = None,
+        max_batch: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+    ) -> None:
+        # Anything with embed(texts) -> float32 matrix (see rag_embedding_providers)
+        self.provider = provider
+        self.cache_size = cache_size or int(os.getenv("QUERY_EMBED_CACHE_SIZE", "4096"))
+        self.window_ms = window_ms if window_ms is not None else float(os.getenv("QUERY_EMBED_WINDOW_MS", "5"))
+        self.max_batch = max_batch or int(os.getenv("QUERY_EMBED_MAX_BATCH", "64"))
+        # The worker thread exits after this many idle seconds and is restarted on demand,
+        # so services that are evicted or replaced do not leave threads behind
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv("QUERY_EMBED_IDLE_S", "10"))
+        self.api_calls = 0
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._queue: "Queue[Tuple[str, str]]" = Queue()
+        self._worker: Optional[threading.Thread] = None
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_many(self, texts: List[str]) -> List[np.ndarray]:
+        """Embed several questions; all cache misses go out in one batched call."""
+        futures = [self.submit(t) for t in texts]
+        return [f.result() for f in futures]
+
+    def submit(self, text: str) -> Future:
+        key = text_key(text)
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+                done: Future = Future()
+                done.set_result(vec)
+                return done
+            fut = self._pending.get(key)
+            if fut is not None:
+                return fut
+            fut = Future()
+            self._pending[key] = fut
+            # Enqueue under the lock so an idle worker cannot exit past this item
+            self._queue.put((key, text))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+                self._worker.start()
+        return fut
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get(timeout=self.idle_timeout)
+            except Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._worker = None
+                        return
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.window_ms / 1000.0
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: List[Tuple[str, str]]) -> None:
+        keys = [k for k, _ in batch]
+        try:
+            self.api_calls += 1
+            vectors = list(np.asarray(self.provider.embed([t for _, t in batch]), dtype=np.float32))
+        except Exception as e:
+            with self._lock:
+                futures = [self._pending.pop(k) for k in keys if k in self._pending]
+            for fut in futures:
+                fut.set_exception(e)
+            return
+        with self._lock:
+            futures = []
+            for key, vec in zip(keys, vectors):
+                vec.setflags(write=False)
+                self._lru[key] = vec
+                self._lru.move_to_end(key)
+                futures.append((self._pending.pop(key, None), vec))
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+        for fut, vec in futures:
+            if fut is not None:
+                fut.set_result(vec)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding store backed by a local SQLite file.
+
+    Rows are keyed by (model, text_key(text)) and hold the raw float32 vector,
+    so re-indexing the same or overlapping documents only embeds new text.
+    """
+
+    _LOOKUP_CHUNK = 500  # stay well under SQLite's bound-parameter limit
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, key))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique), self._LOOKUP_CHUNK):
+                part = unique[i:i + self._LOOKUP_CHUNK]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({marks})",
+                    [model, *part],
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, keys: Sequence[str], vectors: np.ndarray) -> None:
+        rows = [
+            (model, key, np.asarray(vec, dtype=np.float32).tobytes())
+            for key, vec in zip(keys, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_default_cache(base_dir: str) -> Optional[EmbeddingCache]:
+    """Open the cache at EMBEDDING_CACHE_PATH (default: api_outputs/embedding_cache.sqlite); "off" disables it."""
+    path = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(base_dir, "api_outputs", "embedding_cache.sqlite"))
+    if not path or path.lower() in ("off", "none", "0", "false"):
+        return None
+    return EmbeddingCache(path)
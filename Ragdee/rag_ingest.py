@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from rag_chunks import ChunkRecord
+
+try:
+    import ijson  # incremental parsing keeps memory flat on large combined files (declared dependency)
+except ImportError:  # pragma: no cover - falls back to json.load of whole files
+    ijson = None  # type: ignore
+
+
+# (ordinal of the item inside its source, raw item, page number given by the file layout or None)
+SourceItem = Tuple[int, Any, Optional[int]]
+
+# Patterns like: page_005.json, *_page_001_*.json, *_page_1.json, 1.json
+_PAGE_NAME_RE = re.compile(r"page[_-]?(\d+)")
+_TRAILING_NUMBER_RE = re.compile(r"(\d+)\.json$")
+
+
+def iter_source_items(path: str) -> Iterator[SourceItem]:
+    """
+    Yield the recognition items of one JSON file in document order.
+
+    Supported layouts:
+    - a list of items (per-page output of save_outputs)
+    - {"items": [...]}
+    - combined PDF output {"pages": [{"page_number": n, "elements": [...]}, ...]};
+      element items carry the page number of their page
+    - a single item dict with "text"/"content"
+    Ordinals count items across the whole file, so they index `load_source_items(path)`.
+    """
+    if ijson is not None:
+        yield from _iter_streaming(path)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from _iter_loaded(json.load(f))
+
+
+def load_source_items(path: str) -> List[Any]:
+    """All items of a file as a list, in the same order (and ordinals) as iter_source_items."""
+    return [item for _, item, _ in iter_source_items(path)]
+
+
+def _iter_loaded(data: Any) -> Iterator[SourceItem]:
+    if isinstance(data, list):
+        for ordinal, item in enumerate(data):
+            yield ordinal, item, None
+    elif isinstance(data, dict):
+        if isinstance(data.get("items"), list):
+            for ordinal, item in enumerate(data["items"]):
+                yield ordinal, item, None
+        elif isinstance(data.get("pages"), list):
+            ordinal = 0
+            pages = [p for p in data["pages"] if isinstance(p, dict)]
+            for page_pos, page in enumerate(pages, 1):
+                page_no = _page_number(page.get("page_number"), page_pos)
+                for item in page.get("elements") or []:
+                    yield ordinal, item, page_no
+                    ordinal += 1
+        elif any(k in data for k in ("text", "content")):
+            # If dict and contains text-like fields, treat it as a single item
+            yield 0, data, None
+
+
+def _page_number(value: Any, fallback: int) -> int:
+    return value if isinstance(value, int) and value >= 1 else fallback
+
+
+def _first_char(path: str) -> str:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        while True:
+            ch = f.read(1)
+            if not ch or not ch.isspace():
+                return ch
+
+
+def _iter_streaming(path: str) -> Iterator[SourceItem]:
+    """
+    Incremental parse with ijson: only one item (or, for combined files, one page)
+    is materialized at a time.
+    """
+    first = _first_char(path)
+    if first == "[":
+        with open(path, "rb") as f:
+            for ordinal, item in enumerate(ijson.items(f, "item", use_float=True)):
+                yield ordinal, item, None
+        return
+    if first != "{":
+        return
+
+    ordinal = 0
+    with open(path, "rb") as f:
+        pages = (p for p in ijson.items(f, "pages.item", use_float=True) if isinstance(p, dict))
+        for page_pos, page in enumerate(pages, 1):
+            page_no = _page_number(page.get("page_number"), page_pos)
+            for item in page.get("elements") or []:
+                yield ordinal, item, page_no
+                ordinal += 1
+    if ordinal:
+        return
+    # Not a combined file ({"items": [...]} or a single item); these are small, parse whole
+    with open(path, "r", encoding="utf-8") as f:
+        yield from _iter_loaded(json.load(f))
+
+
+def infer_page_from_filename(name: str) -> Optional[int]:
+    m = _PAGE_NAME_RE.search(name) or _TRAILING_NUMBER_RE.search(name)
+    return int(m.group(1)) if m else None
+
+
+def extract_text(item: Any) -> Optional[str]:
+    if isinstance(item, str):
+        return item
+    if not isinstance(item, dict):
+        return None
+    for key in ("text", "content", "value", "raw_text"):
+        v = item.get(key)
+        if isinstance(v, str) and v.strip():
+            return v
+    # If bbox-text structured
+    if "lines" in item and isinstance(item["lines"], list):
+        text = " ".join([l.get("text", "") for l in item["lines"] if isinstance(l, dict)])
+        return text.strip() or None
+    return None
+
+
+def extract_page(item: Any, page_hint: Optional[int]) -> int:
+    if isinstance(item, dict):
+        for key in ("page", "page_no", "page_index"):
+            v = item.get(key)
+            if isinstance(v, int) and v >= 1:
+                return v
+    return page_hint or 1
+
+
+def extract_line(item: Any) -> Optional[int]:
+    if isinstance(item, dict):
+        for key in ("line", "line_no", "line_number", "row_index", "index"):
+            v = item.get(key)
+            if isinstance(v, int) and v >= 1:
+                return v
+    return None
+
+
+def parse_source(path: str) -> Optional[List[ChunkRecord]]:
+    """
+    Extract (text, page, line, ordinal) chunk records from one JSON file, or None
+    if it cannot be read. Items are streamed, so combined files are never fully loaded.
+    """
+    # Infer page from filename if not present in items
+    page_hint = infer_page_from_filename(os.path.basename(path))
+
+    # Build line counter per page
+    line_counter: Dict[int, int] = {}
+    records: List[ChunkRecord] = []
+    try:
+        for idx, item, layout_page in iter_source_items(path):
+            text = extract_text(item)
+            if not text:
+                continue
+            page = extract_page(item, layout_page or page_hint)
+            # line number preference order: explicit fields -> fallback to idx
+            line = extract_line(item)
+            if line is None:
+                line = line_counter.get(page, 0) + 1
+                line_counter[page] = line
+            records.append((text.strip(), page, line, idx))
+    except Exception:
+        return None
+    return records
+
+
+def _pool_context() -> multiprocessing.context.BaseContext:
+    """
+    Start workers with forkserver (spawn where unavailable): the server process is
+    multi-threaded (event loop, job pool, query embedder), and fork() from it can
+    copy a lock held by another thread into the child and deadlock it.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def parse_sources(paths: Sequence[str], workers: Optional[int] = None) -> List[Optional[List[ChunkRecord]]]:
+    """
+    parse_source over many files, fanned out to a process pool (INGEST_WORKERS,
+    default: CPU count). Results come back in the order of `paths`.
+    """
+    workers = workers or int(os.getenv("INGEST_WORKERS", "0")) or (os.cpu_count() or 1)
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        return [parse_source(p) for p in paths]
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+            # Several files per task keeps IPC overhead low for many small per-page files
+            chunksize = max(1, len(paths) // (workers * 4))
+            return list(pool.map(parse_source, paths, chunksize=chunksize))
+    except (OSError, RuntimeError) as e:
+        # e.g. process creation not permitted in this environment
+        print(f"Parallel ingestion unavailable ({e}); parsing files in-process")
+        return [parse_source(p) for p in paths]
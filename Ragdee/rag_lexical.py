@@ -0,0 +1,144 @@
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Keep identifiers like "INV-2024-001", "3.14" or "a/b" together, and also index their parts
+_COMPOUND_RE = re.compile(r"\w+(?:[-./:]\w+)*")
+_PART_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for m in _COMPOUND_RE.finditer(text.lower()):
+        tok = m.group(0)
+        tokens.append(tok)
+        if not tok.isalnum():
+            tokens.extend(_PART_RE.findall(tok))
+    return tokens
+
+
+class BM25Index:
+    """
+    Okapi BM25 over chunk texts with compact, CSR-style postings.
+
+    - Vocabulary maps term -> term id; postings for term t are
+      doc_ids[offsets[t]:offsets[t + 1]] with matching term frequencies.
+    - Scoring needs no embedding call, so keyword lookups (invoice numbers,
+      names, table headers) are answered entirely in-process.
+    - `update` derives the index of an edited corpus by tokenizing only the added texts.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.doc_len = np.zeros(0, dtype=np.float32)
+        self.doc_norm = np.zeros(0, dtype=np.float32)
+        self.n_docs = 0
+
+    def build(self, texts: Sequence[str]) -> "BM25Index":
+        vocab: Dict[str, int] = {}
+        terms, docs, tfs, doc_len = self._postings(vocab, texts, 0)
+        return self._finish(vocab, terms, docs, tfs, doc_len)
+
+    def update(self, kept: Optional[np.ndarray], texts: Sequence[str]) -> "BM25Index":
+        """
+        New index over the rows where `kept` is set (None = all rows), in order, followed by
+        `texts`. Only the new texts are tokenized; surviving postings are re-numbered and
+        IDF / length normalization are recomputed. `self` is left untouched.
+        """
+        terms = np.repeat(np.arange(len(self.vocab), dtype=np.int64), np.diff(self.offsets))
+        docs, tfs, doc_len = self.doc_ids.astype(np.int64), self.tfs, self.doc_len
+        if kept is not None:
+            live = kept[docs]
+            new_ids = np.cumsum(kept) - 1
+            terms, docs, tfs = terms[live], new_ids[docs[live]], tfs[live]
+            doc_len = doc_len[kept]
+        vocab = dict(self.vocab)
+        add_terms, add_docs, add_tfs, add_len = self._postings(vocab, texts, doc_len.shape[0])
+        return BM25Index(self.k1, self.b)._finish(
+            vocab,
+            np.concatenate([terms, add_terms]),
+            np.concatenate([docs, add_docs]),
+            np.concatenate([tfs, add_tfs]),
+            np.concatenate([doc_len, add_len]),
+        )
+
+    @staticmethod
+    def _postings(vocab: Dict[str, int], texts: Sequence[str], first_doc: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Tokenize texts into (term ids, doc ids, term frequencies, doc lengths), extending vocab."""
+        post_terms: List[int] = []
+        post_docs: List[int] = []
+        post_tfs: List[int] = []
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+
+        for doc, text in enumerate(texts):
+            counts: Dict[int, int] = {}
+            toks = tokenize(text)
+            doc_len[doc] = len(toks)
+            for tok in toks:
+                tid = vocab.setdefault(tok, len(vocab))
+                counts[tid] = counts.get(tid, 0) + 1
+            post_terms.extend(counts.keys())
+            post_docs.extend([first_doc + doc] * len(counts))
+            post_tfs.extend(counts.values())
+        return (
+            np.asarray(post_terms, dtype=np.int64),
+            np.asarray(post_docs, dtype=np.int64),
+            np.asarray(post_tfs, dtype=np.float32),
+            doc_len,
+        )
+
+    def _finish(self, vocab: Dict[str, int], terms: np.ndarray, docs: np.ndarray, tfs: np.ndarray, doc_len: np.ndarray) -> "BM25Index":
+        order = np.argsort(terms, kind="stable")
+        df = np.bincount(terms, minlength=len(vocab))
+
+        self.vocab = vocab
+        self.n_docs = doc_len.shape[0]
+        self.doc_ids = docs[order].astype(np.int32)
+        self.tfs = tfs[order]
+        self.offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=self.offsets[1:])
+        self.idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self.doc_len = doc_len
+        avgdl = float(doc_len.mean()) if self.n_docs else 1.0
+        # Precompute the length-normalization term k1 * (1 - b + b * dl / avgdl) per document
+        self.doc_norm = (self.k1 * (1 - self.b + self.b * doc_len / (avgdl or 1.0))).astype(np.float32)
+        return self
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (doc ids, scores) of the top-k documents, best first; only documents matching a term."""
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids or self.n_docs == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for tid in term_ids:
+            lo, hi = self.offsets[tid], self.offsets[tid + 1]
+            docs = self.doc_ids[lo:hi]
+            tf = self.tfs[lo:hi]
+            scores[docs] += self.idf[tid] * tf * (self.k1 + 1) / (tf + self.doc_norm[docs])
+        matched = np.flatnonzero(scores > 0)
+        k = min(k, matched.shape[0])
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]] if k < matched.shape[0] else matched
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], k: int, rrf_k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse ranked id lists with RRF: score(d) = sum_r 1 / (rrf_k + rank_r(d)). Returns top-k (ids, scores)."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking.tolist(), 1):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (rrf_k + rank)
+    best = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:k]
+    return (
+        np.asarray([d for d, _ in best], dtype=np.int64),
+        np.asarray([s for _, s in best], dtype=np.float32),
+    )
+
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+
+MANIFEST_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+LATEST_RUN_FILE = "latest_run.json"
+
+
+def file_signature(path: str, with_hash: bool = True) -> Dict[str, Any]:
+    """{"mtime", "size"} of a file, plus its content "sha256" when with_hash is set."""
+    st = os.stat(path)
+    sig: Dict[str, Any] = {"mtime": st.st_mtime, "size": st.st_size}
+    if with_hash:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        sig["sha256"] = h.hexdigest()
+    return sig
+
+
+def _write_json_atomic(path: str, data: Dict[str, Any]) -> None:
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def write_run_manifest(run_dir: str, files: List[Tuple[str, Optional[int]]], source: Optional[str] = None) -> str:
+    """
+    Record a run's recognition outputs in <run_dir>/manifest.json and point
+    <outputs_dir>/latest_run.json at the run.
+
+    `files` holds (json path, page count) pairs. The indexer reads this manifest
+    instead of walking the run directory and trusts the stored hashes while a
+    file's size and mtime are unchanged.
+    """
+    run_dir = os.path.abspath(run_dir)
+    entries = []
+    for path, pages in files:
+        if not path or not os.path.isfile(path):
+            continue
+        entry = file_signature(path)
+        entry["path"] = os.path.relpath(os.path.abspath(path), run_dir)
+        entry["pages"] = pages
+        entries.append(entry)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "run_id": os.path.basename(run_dir),
+        "source": source,
+        "created": time.time(),
+        "files": entries,
+    }
+    manifest_path = os.path.join(run_dir, MANIFEST_FILE)
+    _write_json_atomic(manifest_path, manifest)
+    update_latest_run(os.path.dirname(run_dir), run_dir)
+    return manifest_path
+
+
+def update_latest_run(outputs_dir: str, run_dir: str) -> None:
+    _write_json_atomic(
+        os.path.join(outputs_dir, LATEST_RUN_FILE),
+        {"run_id": os.path.basename(run_dir), "run_dir": os.path.abspath(run_dir), "updated": time.time()},
+    )
+
+
+def read_latest_run(outputs_dir: str) -> Optional[str]:
+    """Run directory named by latest_run.json, or None if there is no (valid) pointer."""
+    try:
+        with open(os.path.join(outputs_dir, LATEST_RUN_FILE), "r", encoding="utf-8") as f:
+            run_dir = json.load(f).get("run_dir")
+    except (OSError, ValueError):
+        return None
+    if not run_dir:
+        return None
+    # The outputs tree may have been moved; resolve the run by name next to the pointer
+    local = os.path.join(outputs_dir, os.path.basename(run_dir))
+    return local if os.path.isdir(local) else None
+
+
+def manifest_files(recognition_dir: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Map of absolute JSON path -> {"mtime", "size", "sha256", "pages"} for the files the
+    run's manifest lists under recognition_dir, or None when the run has no manifest.
+    """
+    recognition_dir = os.path.abspath(recognition_dir)
+    run_dir = os.path.dirname(recognition_dir)
+    try:
+        with open(os.path.join(run_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    prefix = recognition_dir + os.sep
+    files: Dict[str, Dict[str, Any]] = {}
+    for entry in manifest.get("files", []):
+        path = os.path.normpath(os.path.join(run_dir, entry.get("path", "")))
+        if path.startswith(prefix):
+            files[path] = {k: entry.get(k) for k in ("mtime", "size", "sha256", "pages")}
+    return files
@@ -0,0 +1,90 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from rag_service import RagService
+
+
+DEFAULT_INDEX = "default"
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+
+def validate_index_name(name: str) -> str:
+    """Index names double as snapshot directory names, so keep them path-safe."""
+    if not _NAME_RE.match(name or ""):
+        raise ValueError(f"Invalid index name: {name!r} (use letters, digits, '_', '-', '.')")
+    return name
+
+
+class IndexRegistry:
+    """
+    Named RagService instances (per run, collection or tenant) held in LRU order.
+
+    - When the estimated resident size exceeds the memory budget, least recently
+      used indexes are evicted; the most recently used one is always kept.
+    - An evicted index is transparently restored through `loader` (normally from
+      its memory-mapped snapshot) the next time it is requested.
+    """
+
+    def __init__(
+        self,
+        memory_budget_bytes: Optional[int] = None,
+        loader: Optional[Callable[[str], Optional[RagService]]] = None,
+    ) -> None:
+        if memory_budget_bytes is None:
+            memory_budget_bytes = int(float(os.getenv("RAG_INDEX_MEMORY_MB", "2048")) * 1024 * 1024)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.loader = loader
+        self._indexes: "OrderedDict[str, RagService]" = OrderedDict()
+        self._lock = threading.RLock()
+        # One lock per name so concurrent requests for an evicted index load it once
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, name: str) -> Optional[RagService]:
+        with self._lock:
+            svc = self._indexes.get(name)
+            if svc is not None:
+                self._indexes.move_to_end(name)
+                return svc
+            if self.loader is None:
+                return None
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            with self._lock:
+                svc = self._indexes.get(name)
+            if svc is None:
+                # Loading can take a while; other names stay available meanwhile
+                svc = self.loader(name)
+                if svc is not None:
+                    self.put(name, svc)
+        return svc
+
+    def put(self, name: str, svc: RagService) -> None:
+        with self._lock:
+            self._indexes[name] = svc
+            self._indexes.move_to_end(name)
+            self._evict()
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            return self._indexes.pop(name, None) is not None
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(svc.memory_bytes() for svc in self._indexes.values())
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {"index": name, "chunks_indexed": len(svc._chunks), "memory_bytes": svc.memory_bytes()}
+                for name, svc in self._indexes.items()
+            ]
+
+    def _evict(self) -> None:
+        total = sum(svc.memory_bytes() for svc in self._indexes.values())
+        while total > self.memory_budget_bytes and len(self._indexes) > 1:
+            name, svc = self._indexes.popitem(last=False)
+            total -= svc.memory_bytes()
+            print(f"Evicted RAG index '{name}' to stay within memory budget")
@@ -0,0 +1,70 @@
+from typing import Tuple
+
+import numpy as np
+
+
+class RelationGraph:
+    """
+    Line-neighborhood relations between chunks, stored CSR-style.
+
+    - Neighbors of row i are indices[indptr[i]:indptr[i + 1]], with the matching
+      absolute line distances in deltas.
+    - Neighbors are chunks on the same page within `window` lines: left side
+      nearest first, then right side nearest first.
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, deltas: np.ndarray, window: int) -> None:
+        self.indptr = indptr
+        self.indices = indices
+        self.deltas = deltas
+        self.window = window
+
+    @classmethod
+    def empty(cls, n: int = 0, window: int = 0) -> "RelationGraph":
+        return cls(np.zeros(n + 1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), window)
+
+    @classmethod
+    def build(cls, pages: np.ndarray, lines: np.ndarray, window: int) -> "RelationGraph":
+        """Build the graph with one sort and two binary searches, no per-page Python loops."""
+        n = pages.shape[0]
+        if n == 0 or window < 0:
+            return cls.empty(n, window)
+        # Sort rows by (page, line, row id); a page's rows are then contiguous and line-ordered
+        order = np.lexsort((np.arange(n), lines, pages))
+        key = (pages[order].astype(np.int64) << 32) + (lines[order].astype(np.int64) + (1 << 31))
+        lo = np.searchsorted(key, key - window, side="left")
+        hi = np.searchsorted(key, key + window, side="right")
+        pos = np.arange(n)
+        left = pos - lo
+        counts_sorted = hi - lo - 1
+
+        counts = np.empty(n, dtype=np.int64)
+        counts[order] = counts_sorted
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        total = int(indptr[-1])
+
+        # For the t-th neighbor of sorted position p: p-1-t on the left side, then p+1+(t-left) on the right
+        owner = np.repeat(pos, counts_sorted)
+        seg_start = np.repeat(np.cumsum(counts_sorted) - counts_sorted, counts_sorted)
+        t = np.arange(total) - seg_start
+        owner_left = left[owner]
+        nbr_pos = np.where(t < owner_left, owner - 1 - t, owner + 1 + (t - owner_left))
+
+        dest = indptr[order[owner]] + t
+        indices = np.empty(total, dtype=np.int32)
+        deltas = np.empty(total, dtype=np.int32)
+        indices[dest] = order[nbr_pos]
+        deltas[dest] = np.abs(key[nbr_pos] - key[owner])
+        return cls(indptr, indices, deltas, window)
+
+    def neighbors(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(neighbor row ids, line distances) of row i."""
+        lo, hi = self.indptr[i], self.indptr[i + 1]
+        return self.indices[lo:hi], self.deltas[lo:hi]
+
+    def __len__(self) -> int:
+        return self.indptr.shape[0] - 1
+
+    def nbytes(self) -> int:
+        return int(self.indptr.nbytes + self.indices.nbytes + self.deltas.nbytes)
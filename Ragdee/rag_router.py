@@ -1,10 +1,16 @@
 import os
-from typing import Optional, List
+import json
+from typing import Dict, Optional, List
 
 from fastapi import APIRouter, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from rag_service import RagService, build_service_from_latest, find_latest_recognition_dir
+from rag_registry import DEFAULT_INDEX, IndexRegistry, validate_index_name
+from rag_service import RagService, build_service_from_latest, find_latest_recognition_dir, load_latest_snapshot
+from rag_snapshot import index_snapshot_dir
 
 BASE_DIR = os.path.dirname(__file__)
 
@@ -14,22 +20,43 @@ router = APIRouter(tags=["rag"])
 class InitRequest(BaseModel):
     recognition_dir: Optional[str] = None
     embedding_model: Optional[str] = None
+    # openai | hashing | local; defaults to EMBEDDING_PROVIDER
+    embedding_provider: Optional[str] = None
     answer_model: Optional[str] = None
     api_key_env: Optional[str] = None
+    # Name of the index to build (per run, collection or tenant)
+    index: Optional[str] = None
+    # Fold the directory into the live index instead of rebuilding it
+    incremental: Optional[bool] = False
 
 
 class InitResponse(BaseModel):
     initialized: bool
     chunks_indexed: int
     recognition_dir: Optional[str] = None
+    changes: Optional[Dict[str, int]] = None
+    index: str = DEFAULT_INDEX
 
 
 class QueryRequest(BaseModel):
     question: str
+    index: Optional[str] = None
     k: Optional[int] = 3
     include_relations: Optional[bool] = None
     relation_window: Optional[int] = None
     max_group_items: Optional[int] = None
+    # vector | hybrid | lexical; defaults to RETRIEVAL_MODE
+    mode: Optional[str] = None
+
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    index: Optional[str] = None
+    k: Optional[int] = 3
+    include_relations: Optional[bool] = None
+    relation_window: Optional[int] = None
+    max_group_items: Optional[int] = None
+    mode: Optional[str] = None
 
 
 class RelatedOut(BaseModel):
@@ -53,41 +80,117 @@ class QueryResponse(BaseModel):
     sources: List[SourceOut]
 
 
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]
+
+
+class SearchResponse(BaseModel):
+    sources: List[SourceOut]
+
+
+def get_registry(app) -> IndexRegistry:
+    """Return the app-wide index registry, creating it on first use."""
+    registry = getattr(app.state, "rag_registry", None)
+    if registry is None:
+        registry = IndexRegistry(loader=lambda name: load_latest_snapshot(BASE_DIR, name))
+        app.state.rag_registry = registry
+    return registry
+
+
+def _index_name(name: Optional[str]) -> str:
+    try:
+        return validate_index_name(name or DEFAULT_INDEX)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def get_service(request: Request, index: Optional[str]) -> RagService:
+    name = _index_name(index)
+    try:
+        svc = get_registry(request.app).get(name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load RAG index '{name}': {e}")
+    if svc is None:
+        raise HTTPException(status_code=400, detail=f"RAG index '{name}' is not initialized. Call /rag/init first.")
+    return svc
+
+
+def restore_rag_service(app) -> None:
+    """Warm the default index from its persisted snapshot so queries work right after a restart."""
+    try:
+        svc = get_registry(app).get(DEFAULT_INDEX)
+    except Exception as e:
+        print(f"Could not restore RAG snapshot: {e}")
+        return
+    if svc is not None:
+        print(f"Restored RAG index with {len(svc._chunks)} chunks from snapshot")
+
+
+def _sources_out(sources: List[dict]) -> List[SourceOut]:
+    return [
+        SourceOut(
+            page=s.get("page", 0),
+            line=s.get("line", 0),
+            percentage=s.get("percentage", s.get("percent", 0.0)),
+            score=s.get("score", 0.0),
+            text=s.get("text", ""),
+            related=[
+                RelatedOut(
+                    page=r.get("page", 0),
+                    line=r.get("line", 0),
+                    score=r.get("score", 0.0),
+                    text=r.get("text", "")
+                ) for r in s.get("related", [])
+            ]
+        ) for s in sources
+    ]
+
+
 @router.post("/init", response_model=InitResponse)
 def init_rag(request: Request, body: InitRequest) -> InitResponse:
     try:
         svc: Optional[RagService] = None
         recognition_dir = body.recognition_dir
+        index = _index_name(body.index)
+        registry = get_registry(request.app)
+
+        live: Optional[RagService] = registry.get(index) if body.incremental else None
+        if live is not None:
+            recognition_dir = recognition_dir or find_latest_recognition_dir(os.path.join(BASE_DIR, "api_outputs"))
+            if not recognition_dir or not os.path.isdir(recognition_dir):
+                raise HTTPException(status_code=400, detail=f"recognition_dir not found: {recognition_dir}")
+            changes = live.sync_recognition_dir(recognition_dir)
+            return InitResponse(
+                initialized=True, chunks_indexed=len(live._chunks), recognition_dir=recognition_dir, changes=changes, index=index
+            )
 
+        service_kwargs = dict(
+            embedding_model=body.embedding_model,
+            provider=body.embedding_provider,
+            answer_model=body.answer_model or "gpt-4o-mini",
+            api_key_env=body.api_key_env or "OPENAI_API_KEY",
+        )
         if recognition_dir:
             if not os.path.isdir(recognition_dir):
                 raise HTTPException(status_code=400, detail=f"recognition_dir not found: {recognition_dir}")
-            svc = RagService(
-                embedding_model=body.embedding_model or "text-embedding-3-small",
-                answer_model=body.answer_model or "gpt-4o-mini",
-                api_key_env=body.api_key_env or "OPENAI_API_KEY",
-            )
+            svc = RagService(**service_kwargs, snapshot_dir=index_snapshot_dir(BASE_DIR, index))
             svc.index_recognition_dir(recognition_dir)
         else:
             # Try latest run under api_outputs
-            svc = build_service_from_latest(BASE_DIR)
+            svc = build_service_from_latest(BASE_DIR, index=index, **service_kwargs)
             if svc is None:
                 # Fallback: look up recognition_json path under api_outputs explicitly
                 latest_rec_dir = find_latest_recognition_dir(os.path.join(BASE_DIR, "api_outputs"))
                 if latest_rec_dir is None:
                     raise HTTPException(status_code=404, detail="No recognition_json directory found under api_outputs")
-                svc = RagService(
-                    embedding_model=body.embedding_model or "text-embedding-3-small",
-                    answer_model=body.answer_model or "gpt-4o-mini",
-                    api_key_env=body.api_key_env or "OPENAI_API_KEY",
-                )
+                svc = RagService(**service_kwargs, snapshot_dir=index_snapshot_dir(BASE_DIR, index))
                 svc.index_recognition_dir(latest_rec_dir)
                 recognition_dir = latest_rec_dir
 
-        request.app.state.rag_service = svc
+        registry.put(index, svc)
         # Access internal chunk count for status
         chunk_count = len(getattr(svc, "_chunks", []) )
-        return InitResponse(initialized=True, chunks_indexed=chunk_count, recognition_dir=recognition_dir)
+        return InitResponse(initialized=True, chunks_indexed=chunk_count, recognition_dir=recognition_dir, index=index)
     except HTTPException:
         raise
     except Exception as e:
@@ -95,43 +198,99 @@ def init_rag(request: Request, body: InitRequest) -> InitResponse:
 
 
 @router.get("/status")
-def rag_status(request: Request):
-    svc = getattr(request.app.state, "rag_service", None)
-    if not svc:
-        return {"initialized": False, "chunks_indexed": 0}
-    return {"initialized": True, "chunks_indexed": len(getattr(svc, "_chunks", []))}
+def rag_status(request: Request, index: Optional[str] = None):
+    registry = get_registry(request.app)
+    svc = registry.get(_index_name(index))
+    status = {"initialized": svc is not None, "chunks_indexed": len(svc._chunks) if svc else 0}
+    status["indexes"] = registry.stats()
+    return status
 
 
 @router.post("/query", response_model=QueryResponse)
-def rag_query(request: Request, body: QueryRequest) -> QueryResponse:
-    svc: Optional[RagService] = getattr(request.app.state, "rag_service", None)
-    if svc is None:
-        raise HTTPException(status_code=400, detail="RAG service is not initialized. Call /rag/init first.")
+async def rag_query(request: Request, body: QueryRequest) -> QueryResponse:
+    # Resolving may reload an evicted index from disk, so keep it off the event loop
+    svc = await run_in_threadpool(get_service, request, body.index)
     try:
-        result = svc.query(
+        result = await svc.aquery(
             body.question,
             max_sources=body.k or 3,
             include_relations=body.include_relations,
             relation_window=body.relation_window,
             max_group_items=body.max_group_items or 5,
+            mode=body.mode,
         )
-        sources_out = [
-            SourceOut(
-                page=s.get("page", 0),
-                line=s.get("line", 0),
-                percentage=s.get("percentage", s.get("percent", 0.0)),
-                score=s.get("score", 0.0),
-                text=s.get("text", ""),
-                related=[
-                    RelatedOut(
-                        page=r.get("page", 0),
-                        line=r.get("line", 0),
-                        score=r.get("score", 0.0),
-                        text=r.get("text", "")
-                    ) for r in s.get("related", [])
-                ]
-            ) for s in result.get("sources", [])
-        ]
+        sources_out = _sources_out(result.get("sources", []))
         return QueryResponse(answer=result.get("answer", ""), sources=sources_out)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query failed: {e}")
+
+
+@router.post("/query/batch", response_model=BatchQueryResponse)
+async def rag_query_batch(request: Request, body: BatchQueryRequest) -> BatchQueryResponse:
+    """Answer many questions at once; results are returned in the order of `questions`."""
+    svc = await run_in_threadpool(get_service, request, body.index)
+    try:
+        results = await svc.aquery_many(
+            body.questions,
+            max_sources=body.k or 3,
+            include_relations=body.include_relations,
+            relation_window=body.relation_window,
+            max_group_items=body.max_group_items or 5,
+            mode=body.mode,
+        )
+        return BatchQueryResponse(results=[
+            QueryResponse(answer=r.get("answer", ""), sources=_sources_out(r.get("sources", []))) for r in results
+        ])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Query failed: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Batch query failed: {e}")
+
+
+@router.post("/search", response_model=SearchResponse)
+def rag_search(request: Request, body: QueryRequest) -> SearchResponse:
+    """Retrieval only (no answer generation); with mode "lexical" no OpenAI call is made."""
+    svc = get_service(request, body.index)
+    try:
+        result = svc.search(
+            body.question,
+            max_sources=body.k or 3,
+            include_relations=body.include_relations,
+            relation_window=body.relation_window,
+            max_group_items=body.max_group_items or 5,
+            mode=body.mode,
+        )
+        return SearchResponse(sources=_sources_out(result.get("sources", [])))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {e}")
+
+
+@router.post("/query/stream")
+async def rag_query_stream(request: Request, body: QueryRequest) -> StreamingResponse:
+    """
+    Stream the answer as NDJSON: one "sources" event as soon as retrieval finishes,
+    then "token" events while the answer is generated, then "done" (or "error").
+    """
+    svc = await run_in_threadpool(get_service, request, body.index)
+
+    async def events():
+        try:
+            async for event in svc.astream_query(
+                body.question,
+                max_sources=body.k or 3,
+                include_relations=body.include_relations,
+                relation_window=body.relation_window,
+                max_group_items=body.max_group_items or 5,
+                mode=body.mode,
+            ):
+                if event["type"] == "sources":
+                    event = {"type": "sources", "sources": jsonable_encoder(_sources_out(event["sources"]))}
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": f"Query failed: {e}"}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
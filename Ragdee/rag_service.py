@@ -1,9 +1,24 @@
 import os
 import json
-import math
 import glob
-from dataclasses import dataclass
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+
+import numpy as np
+
+import rag_manifest
+import rag_snapshot
+from rag_answer_cache import AnswerCache, make_answer_cache, normalize_question
+from rag_chunks import ChunkRecord, ChunkStore
+from rag_context import make_token_counter, pack_context
+from rag_ingest import load_source_items, parse_sources
+from rag_relations import RelationGraph
+from rag_lexical import BM25Index, reciprocal_rank_fusion
+from rag_vector_index import IVFIndex, VectorIndex, make_vector_index
+from rag_embedding_providers import EmbeddingProvider, make_embedding_provider
+from rag_embeddings import EmbeddingCache, ProgressCallback, QueryEmbedder, open_default_cache, text_key
 
 try:
     from dotenv import load_dotenv
@@ -12,18 +27,40 @@ except ImportError:
     pass 
 
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI, OpenAI
 except ImportError:
     OpenAI = None  
+    AsyncOpenAI = None
 
 
-@dataclass
-class SourceChunk:
-    text: str
-    page: int
-    line: int
-    meta: Dict[str, Any]
-    embedding: Optional[List[float]] = None
+RETRIEVAL_MODES = ("vector", "hybrid", "lexical")
+
+ANSWER_PROMPT = (
+    "You are a helpful assistant. Answer the user based ONLY on the provided context. "
+    "If the answer is not in context, say you cannot find it in the document.\n\n"
+    "Context:\n{context}\n\n"
+    "Question: {question}"
+)
+
+
+class _IndexState:
+    """
+    One consistent version of the index: chunk columns, embedding matrix and relation
+    graph over the same rows. Mutations build a new state and publish it with a single
+    assignment; queries capture the current state once, so they never combine row ids
+    of one version with columns of another. Search structures are built lazily per state.
+    """
+
+    __slots__ = ("chunks", "embeddings", "relations", "version", "vindex", "bm25", "nbytes")
+
+    def __init__(self, chunks: ChunkStore, embeddings: np.ndarray, relations: RelationGraph, version: int) -> None:
+        self.chunks = chunks
+        self.embeddings = embeddings
+        self.relations = relations
+        self.version = version
+        self.vindex: Optional[VectorIndex] = None
+        self.bm25: Optional[BM25Index] = None
+        self.nbytes: Optional[int] = None
 
 
 class RagService:
@@ -43,37 +80,126 @@ class RagService:
         api_key_env: str = "OPENAI_API_KEY",
         max_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
+        progress_callback: Optional[ProgressCallback] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        snapshot_dir: Optional[str] = None,
+        client: Any = None,
+        async_client: Any = None,
+        answer_cache: Optional[AnswerCache] = None,
+        embedding_provider: Optional[EmbeddingProvider] = None,
+        provider: Optional[str] = None,
+        embedding_dim: Optional[int] = None,
     ) -> None:
-        api_key = os.getenv(api_key_env)
-        if OpenAI is None:
-            raise RuntimeError(
-                "OpenAI SDK not available. Install with `pip install openai` and set OPENAI_API_KEY."
-            )
-        if not api_key:
-            raise RuntimeError("Missing OPENAI_API_KEY environment variable.")
-
-        self.client = OpenAI()
+        provider_kind = (embedding_provider.kind if embedding_provider is not None
+                         else (provider or os.getenv("EMBEDDING_PROVIDER", "openai")).lower())
+        # Injected clients (e.g. local fakes in tests) skip the SDK/API key checks.
+        # With a local embedding provider the OpenAI client is only needed for answers,
+        # so retrieval (search, lexical mode) also works offline.
+        if client is None or async_client is None:
+            api_key = os.getenv(api_key_env)
+            if OpenAI is not None and api_key:
+                client = client or OpenAI()
+                async_client = async_client or AsyncOpenAI()
+            elif provider_kind == "openai":
+                if OpenAI is None:
+                    raise RuntimeError(
+                        "OpenAI SDK not available. Install with `pip install openai` and set OPENAI_API_KEY."
+                    )
+                raise RuntimeError("Missing OPENAI_API_KEY environment variable.")
+
+        self.client = client
+        # Recorded in snapshots so a reloaded index keeps its credentials and answer model
+        self.api_key_env = api_key_env
+        # Non-blocking client for the async query paths (aquery, astream_query)
+        self.async_client = async_client
+
+        # Embedding backend (EMBEDDING_PROVIDER=openai | hashing | local, EMBEDDING_DIM)
+        self.embedding_provider = embedding_provider or make_embedding_provider(
+            provider_kind, self.client, embedding_model, embedding_dim, progress=progress_callback
+        )
+        # Identifies the vector space: keys the embedding cache and is checked against snapshots
+        self.embedding_model = self.embedding_provider.name
         
         # Load configuration from environment variables with fallbacks
-        self.embedding_model = embedding_model or os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
         self.answer_model = answer_model or os.getenv("ANSWER_MODEL", "gpt-4o-mini")
         self.max_tokens = max_tokens or int(os.getenv("MAX_TOKENS", "4096"))
         self.temperature = temperature or float(os.getenv("TEMPERATURE", "0.2"))
+        # Prompt size cap (question + packed context), counted locally
+        self.context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+        self._count_tokens = make_token_counter(self.answer_model)
         # New relation config
         self.relation_window_default = int(os.getenv("RELATION_WINDOW", "2"))
         self.include_relations_default = os.getenv("INCLUDE_RELATIONS", "true").lower() in ("1", "true", "yes")
-        
-        self._chunks: List[SourceChunk] = []
-        self._page_index: Dict[int, List[int]] = {}
-        # Relation index: chunk_idx -> neighbor indices
-        self._relations: Dict[int, List[int]] = {}
-        # Optional for quick lookup by page
-        self._page_index: Dict[int, List[int]] = {}
+        # vector | hybrid (BM25 + vector, RRF-fused) | lexical (BM25 only, no embedding call)
+        self.retrieval_mode_default = os.getenv("RETRIEVAL_MODE", "vector").lower()
+        # Concurrent completions per query_many / aquery_many call
+        self.batch_concurrency = max(1, int(os.getenv("QUERY_BATCH_CONCURRENCY", "8")))
+        # Query-time embeddings: LRU + micro-batching of concurrent questions
+        self.query_embedder = QueryEmbedder(self.embedding_provider)
+        # Content-addressed cache so unchanged text is never re-embedded
+        self.embedding_cache = embedding_cache if embedding_cache is not None else open_default_cache(os.path.dirname(__file__))
+        # Where index_recognition_dir persists its result (None disables snapshots)
+        self.snapshot_dir = snapshot_dir
+        self.recognition_dir: Optional[str] = None
+        # Repeat/near-duplicate question cache; entries are tied to _version
+        self.answer_cache = answer_cache if answer_cache is not None else make_answer_cache()
+        # Current index version (see _IndexState); its version number is bumped on every
+        # mutation so cached answers never outlive the content they cite
+        self._state = _IndexState(self._new_store(), np.zeros((0, 0), dtype=np.float32), RelationGraph.empty(), 0)
+        # Serializes mutations; queries never take it
+        self._write_lock = threading.RLock()
+        # Guards lazy builds of search structures on states published without them
+        self._vindex_lock = threading.Lock()
+        # Indexed JSON files: path -> {"mtime", "size", "sha256"}
+        self._sources: Dict[str, Dict[str, Any]] = {}
+        # Signatures recorded in run manifests, used to skip re-hashing unchanged files
+        self._manifest_sigs: Dict[str, Dict[str, Any]] = {}
+
+    # Read-only views of the current state (row i of each belongs to the same chunk
+    # only within one state; query paths capture self._state once instead)
+    @property
+    def _chunks(self) -> ChunkStore:
+        return self._state.chunks
+
+    @property
+    def _embeddings(self) -> np.ndarray:
+        return self._state.embeddings
+
+    @property
+    def _relations(self) -> RelationGraph:
+        return self._state.relations
+
+    @property
+    def _version(self) -> int:
+        return self._state.version
+
+    def _new_store(self) -> ChunkStore:
+        # Columnar chunk storage; item metadata is re-read from the source JSON on demand
+        return ChunkStore(meta_loader=self._load_source_items)
+
+    def _publish(
+        self,
+        chunks: ChunkStore,
+        embeddings: np.ndarray,
+        relations: RelationGraph,
+        vindex: Optional[VectorIndex] = None,
+        bm25: Optional[BM25Index] = None,
+    ) -> None:
+        """
+        Swap in a new index version with one assignment. Its vector and BM25 indexes are
+        built first unless passed in (carried over or restored), so no query ever waits on
+        them. Callers hold _write_lock.
+        """
+        state = _IndexState(chunks, embeddings, relations, self._state.version + 1)
+        state.vindex = vindex if vindex is not None else make_vector_index(embeddings.shape[0]).build(embeddings)
+        state.bm25 = bm25 if bm25 is not None else BM25Index().build(chunks.texts)
+        self._state = state
 
     # --------------- Indexing ---------------
     def clear_index(self) -> None:
-        self._chunks.clear()
-        self._page_index.clear()
+        with self._write_lock:
+            self._sources = {}
+            self._publish(self._new_store(), np.zeros((0, 0), dtype=np.float32), RelationGraph.empty())
 
     def index_recognition_dir(self, recognition_dir: str) -> int:
         """
@@ -85,264 +211,742 @@ class RagService:
         if not os.path.isdir(recognition_dir):
             raise FileNotFoundError(f"Recognition dir not found: {recognition_dir}")
 
-        total = 0
-        self.clear_index()
+        with self._write_lock:
+            # Built off to the side; queries keep using the previous index until it is published
+            self._apply_source_changes(remove=[], add=self._list_json_files(recognition_dir), rebuild=True)
+            self.recognition_dir = recognition_dir
+            if self.snapshot_dir:
+                self.save_snapshot(self.snapshot_dir)
+            return len(self._chunks)
+
+    # --------------- Incremental indexing ---------------
+    def add_source(self, path: str) -> int:
+        """Index one JSON file (re-indexing it if already present). Returns chunks added."""
+        path = os.path.abspath(path)
+        with self._write_lock:
+            remove = [path] if path in self._sources else []
+            return self._apply_source_changes(remove=remove, add=[path])
+
+    def update_source(self, path: str) -> int:
+        """Re-index a JSON file only if its content changed. Returns chunks added."""
+        path = os.path.abspath(path)
+        with self._write_lock:
+            if path in self._sources and not self._source_changed(path):
+                return 0
+            return self.add_source(path)
+
+    def remove_source(self, path: str) -> int:
+        """Drop every chunk that came from a JSON file. Returns chunks removed."""
+        path = os.path.abspath(path)
+        with self._write_lock:
+            if path not in self._sources:
+                return 0
+            before = len(self._chunks)
+            self._apply_source_changes(remove=[path], add=[])
+            return before - len(self._chunks)
+
+    def sync_recognition_dir(self, recognition_dir: str) -> Dict[str, int]:
+        """
+        Fold a recognition_json directory into the live index.
+        Only new, changed or deleted files under that directory are touched;
+        sources from other directories stay indexed.
+        """
+        recognition_dir = os.path.abspath(recognition_dir)
+        if not os.path.isdir(recognition_dir):
+            raise FileNotFoundError(f"Recognition dir not found: {recognition_dir}")
 
+        with self._write_lock:
+            current = self._list_json_files(recognition_dir)
+            current_set = set(current)
+            prefix = recognition_dir + os.sep
+            removed = [p for p in self._sources if p.startswith(prefix) and p not in current_set]
+            added = [p for p in current if p not in self._sources]
+            changed = [p for p in current if p in self._sources and self._source_changed(p)]
+
+            if removed or added or changed:
+                self._apply_source_changes(remove=removed + changed, add=added + changed)
+                if self.snapshot_dir:
+                    self.save_snapshot(self.snapshot_dir)
+            self.recognition_dir = recognition_dir
+            return {
+                "added": len(added),
+                "updated": len(changed),
+                "removed": len(removed),
+                "unchanged": len(current) - len(added) - len(changed),
+                "chunks": len(self._chunks),
+            }
+
+    def _list_json_files(self, recognition_dir: str) -> List[str]:
+        # Runs written by the API carry a manifest: no directory walk, and its hashes are reused
+        listed = rag_manifest.manifest_files(recognition_dir)
+        if listed is not None:
+            json_files = [p for p in sorted(listed) if os.path.isfile(p)]
+            for p in json_files:
+                self._manifest_sigs[p] = listed[p]
+            return json_files
         json_files = sorted(glob.glob(os.path.join(recognition_dir, "**", "*.json"), recursive=True))
         if not json_files:
             # If directory structure differs, allow reading a single summary.json
             json_files = [os.path.join(recognition_dir, "summary.json")] if os.path.exists(os.path.join(recognition_dir, "summary.json")) else []
-
-        for jf in json_files:
-            try:
-                with open(jf, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-            except Exception:
+        return json_files
+
+    def _file_signature(self, path: str) -> Dict[str, Any]:
+        """Signature with content hash; the manifest's hash is reused while size and mtime match."""
+        known = self._manifest_sigs.get(path)
+        if known and known.get("sha256"):
+            quick = rag_manifest.file_signature(path, with_hash=False)
+            if quick["mtime"] == known.get("mtime") and quick["size"] == known.get("size"):
+                return dict(quick, sha256=known["sha256"])
+        return rag_manifest.file_signature(path)
+
+    def _source_changed(self, path: str) -> bool:
+        old = self._sources.get(path)
+        if old is None or not os.path.exists(path):
+            return True
+        quick = rag_manifest.file_signature(path, with_hash=False)
+        if quick["mtime"] == old.get("mtime") and quick["size"] == old.get("size"):
+            return False
+        # mtime/size moved; only a content hash change counts as an update
+        return self._file_signature(path)["sha256"] != old.get("sha256")
+
+    def _load_source_items(self, jf: str) -> List[Any]:
+        """Read one JSON file and normalize it to its list of items (meta loader for ChunkStore)."""
+        return load_source_items(jf)
+
+    def _apply_source_changes(self, remove: List[str], add: List[str], rebuild: bool = False) -> int:
+        """
+        Remove the chunks of `remove`, then append chunks parsed from `add` (on an empty
+        index when `rebuild` is set). Embeddings of surviving chunks are kept and only new
+        text is embedded. The BM25 index and trained IVF cells of the previous version are
+        updated with the delta (only new text is tokenized, only new rows are assigned);
+        the relation graph and column copies are still O(corpus), but vectorized and cheap
+        next to embedding. Everything is built on copies and published together, so
+        concurrent queries see either the old index or the new one. Callers hold _write_lock.
+        Returns the number of chunks added.
+        """
+        state = self._state
+        if rebuild:
+            chunks, embeddings, sources = self._new_store(), np.zeros((0, 0), dtype=np.float32), {}
+        else:
+            chunks, embeddings, sources = state.chunks.copy(), state.embeddings, dict(self._sources)
+        changed = rebuild
+        kept: Optional[np.ndarray] = None
+        reusable: Dict[str, np.ndarray] = {}
+
+        if remove:
+            dropped = chunks.rows_of_sources(remove)
+            for i in np.flatnonzero(dropped).tolist():
+                reusable[text_key(chunks.texts[i])] = embeddings[i]
+            if dropped.any():
+                changed = True
+                # Row ids shift; relations are rebuilt below
+                kept = ~dropped
+                chunks.compact(kept)
+                embeddings = np.ascontiguousarray(embeddings[kept])
+            for p in remove:
+                sources.pop(p, None)
+
+        parsed: List[Tuple[str, List[ChunkRecord]]] = []
+        # Files are parsed in parallel (INGEST_WORKERS) and merged back in file order
+        for jf, records in zip(add, parse_sources(add)):
+            if records is None:
                 continue
+            sources[jf] = self._file_signature(jf)
+            parsed.append((jf, records))
+
+        new_texts = [r[0] for _, records in parsed for r in records]
+        if new_texts:
+            keys = [text_key(t) for t in new_texts]
+            todo = [i for i, k in enumerate(keys) if k not in reusable]
+            fresh = self._embed_windowed([new_texts[i] for i in todo]) if todo else None
+            dim = fresh.shape[1] if fresh is not None else len(next(iter(reusable.values())))
+            matrix = np.empty((len(new_texts), dim), dtype=np.float32)
+            if fresh is not None:
+                matrix[todo] = fresh
+            for i, k in enumerate(keys):
+                if k in reusable:
+                    matrix[i] = reusable[k]
+
+            for jf, records in parsed:
+                chunks.extend(jf, records)
+            if embeddings.shape[0] == 0:
+                embeddings = np.ascontiguousarray(matrix)
+            else:
+                embeddings = np.vstack([embeddings, matrix])
+            changed = True
+
+        if not changed:
+            relations, vindex, bm25 = state.relations, state.vindex, state.bm25
+        else:
+            relations = self._build_relations(chunks)
+            vindex, bm25 = (None, None) if rebuild else self._updated_indexes(state, kept, embeddings, new_texts)
+        self._sources = sources
+        self._publish(chunks, embeddings, relations, vindex, bm25)
+        return len(new_texts)
+
+    def _updated_indexes(
+        self, state: _IndexState, kept: Optional[np.ndarray], embeddings: np.ndarray, new_texts: List[str]
+    ) -> Tuple[Optional[VectorIndex], Optional[BM25Index]]:
+        """Derive the search indexes of an edited corpus from `state`'s; None = build from scratch."""
+        vindex = None
+        if isinstance(state.vindex, IVFIndex) and isinstance(make_vector_index(embeddings.shape[0]), IVFIndex):
+            vindex = state.vindex.update(embeddings, kept)
+        bm25 = state.bm25.update(kept, new_texts) if state.bm25 is not None else None
+        return vindex, bm25
+
+    def memory_bytes(self) -> int:
+        """Rough resident size of the index, used for registry eviction (computed once per index version)."""
+        state = self._state
+        if state.nbytes is None:
+            state.nbytes = int(state.embeddings.nbytes) + state.chunks.nbytes() + state.relations.nbytes()
+        return state.nbytes
+
+    # --------------- Snapshots ---------------
+    def save_snapshot(self, snapshot_dir: str) -> str:
+        """Persist the current index (embeddings, chunk columns, relations) to snapshot_dir."""
+        with self._write_lock:
+            return self._write_snapshot(snapshot_dir, self._state)
+
+    def _write_snapshot(self, snapshot_dir: str, state: _IndexState) -> str:
+        store = state.chunks
+        # The trained ANN cells (if IVF is used) are persisted so restarts do not retrain them
+        vindex = self._vector_index(state) if state.embeddings.shape[0] else None
+        return rag_snapshot.write_snapshot(
+            snapshot_dir,
+            info={
+                "embedding_model": self.embedding_model,
+                "embedding_provider": self.embedding_provider.kind,
+                "embedding_provider_model": getattr(self.embedding_provider, "model_id", None),
+                "embedding_dim": self.embedding_provider.dim,
+                "answer_model": self.answer_model,
+                "api_key_env": self.api_key_env,
+                "recognition_dir": self.recognition_dir,
+                "sources": [dict(sig, path=p) for p, sig in self._sources.items()],
+                "source_paths": store.sources,
+            },
+            embeddings=state.embeddings,
+            texts=store.texts,
+            pages=store.pages,
+            lines=store.lines,
+            source_ids=store.source_ids,
+            ordinals=store.ordinals,
+            relations=state.relations,
+            ivf=vindex if isinstance(vindex, IVFIndex) else None,
+        )
 
-            # Infer page from filename if not present in items
-            page_hint = self._infer_page_from_filename(os.path.basename(jf))
-
-            # Normalize to iterable of items
-            items = []
-            if isinstance(data, dict):
-                if "items" in data and isinstance(data["items"], list):
-                    items = data["items"]
-                else:
-                    # If dict and contains text-like fields, treat it as a single item
-                    if any(k in data for k in ("text", "content")):
-                        items = [data]
-            elif isinstance(data, list):
-                items = data
-
-            # Build line counter per page
-            line_counter: Dict[int, int] = {}
-
-            for idx, item in enumerate(items):
-                text = self._extract_text(item)
-                if not text:
-                    continue
-
-                page = self._extract_page(item, page_hint)
-                # line number preference order: explicit fields -> fallback to idx
-                line = self._extract_line(item)
-                if line is None:
-                    prev = line_counter.get(page, 0)
-                    line = prev + 1
-                    line_counter[page] = line
-
-                chunk = SourceChunk(text=text.strip(), page=page, line=line, meta=item)
-                self._chunks.append(chunk)
-                total += 1
-
-        # Compute embeddings in batches for efficiency
-        self._embed_all()
-        self._rebuild_page_index()
-        return total
-
-    def _infer_page_from_filename(self, name: str) -> Optional[int]:
-        # Try patterns like: page_005.json, *_page_001_*.json, *_page_1.json, 1.json
-        import re
-        m = re.search(r"page[_-]?(\d+)", name)
-        if m:
-            try:
-                return int(m.group(1))
-            except ValueError:
-                pass
-        m2 = re.search(r"(\d+)\.json$", name)
-        if m2:
-            try:
-                return int(m2.group(1))
-            except ValueError:
-                pass
-        return None
+    def load_snapshot(self, snapshot_dir: str) -> int:
+        """Replace the index with a snapshot; embeddings stay memory-mapped. Returns chunk count."""
+        snap = rag_snapshot.read_snapshot(snapshot_dir)
+        info = snap["info"]
+        if info.get("embedding_model") != self.embedding_model:
+            raise ValueError(
+                f"Snapshot was built with {info.get('embedding_model')!r}, service uses {self.embedding_model!r}"
+            )
+        chunks = self._new_store()
+        chunks.load_columns(
+            info.get("source_paths", []),
+            snap["texts"],
+            snap["pages"],
+            snap["lines"],
+            snap["source_ids"],
+            snap["ordinals"],
+        )
+        relations = snap["relations"]
+        if relations.window != self.relation_window_default:
+            relations = self._build_relations(chunks)
+        with self._write_lock:
+            self._sources = {sig.pop("path"): sig for sig in info.get("sources", [])}
+            # Saved IVF cells are reused unless the configured backend is no longer IVF
+            ivf = snap["ivf"] if isinstance(make_vector_index(len(chunks)), IVFIndex) else None
+            self._publish(chunks, snap["embeddings"], relations, vindex=ivf)
+            self.recognition_dir = info.get("recognition_dir")
+            return len(chunks)
+
+    @classmethod
+    def from_snapshot(cls, snapshot_dir: str, **kwargs: Any) -> "RagService":
+        """
+        Create a service from a snapshot, using the embedding provider, answer model and
+        API key variable it was built with (explicit kwargs take precedence).
+        """
+        info = rag_snapshot.read_snapshot_info(snapshot_dir)
+        for key in ("answer_model", "api_key_env"):
+            if info.get(key):
+                kwargs.setdefault(key, info[key])
+        if kwargs.get("embedding_provider") is None:
+            kwargs.setdefault("provider", info.get("embedding_provider", "openai"))
+            kwargs.setdefault("embedding_model", info.get("embedding_provider_model") or info.get("embedding_model"))
+            kwargs.setdefault("embedding_dim", info.get("embedding_dim"))
+        kwargs.setdefault("snapshot_dir", snapshot_dir)
+        svc = cls(**kwargs)
+        svc.load_snapshot(snapshot_dir)
+        return svc
 
-    def _extract_text(self, item: Any) -> Optional[str]:
-        if isinstance(item, str):
-            return item
-        if not isinstance(item, dict):
-            return None
-        for key in ("text", "content", "value", "raw_text"):
-            v = item.get(key)
-            if isinstance(v, str) and v.strip():
-                return v
-        # If bbox-text structured
-        if "lines" in item and isinstance(item["lines"], list):
-            text = " ".join([l.get("text", "") for l in item["lines"] if isinstance(l, dict)])
-            return text.strip() or None
-        return None
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        """L2-normalize rows once so scoring is a plain dot product."""
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1e-9
+        return np.ascontiguousarray(matrix / norms, dtype=np.float32)
 
-    def _extract_page(self, item: Any, page_hint: Optional[int]) -> int:
-        if isinstance(item, dict):
-            for key in ("page", "page_no", "page_index"):
-                v = item.get(key)
-                if isinstance(v, int) and v >= 1:
-                    return v
-        return page_hint or 1
-
-    def _extract_line(self, item: Any) -> Optional[int]:
-        if isinstance(item, dict):
-            for key in ("line", "line_no", "line_number", "row_index", "index"):
-                v = item.get(key)
-                if isinstance(v, int) and v >= 1:
-                    return v
-        return None
+    def _embed_windowed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed and normalize texts in windows of INGEST_WINDOW chunks, writing each window
+        into one preallocated matrix so provider responses never pile up for a whole document.
+        """
+        window = max(1, int(os.getenv("INGEST_WINDOW", "2048")))
+        out: Optional[np.ndarray] = None
+        for start in range(0, len(texts), window):
+            part = self._normalize(self._embed_texts(texts[start:start + window]))
+            if out is None:
+                out = np.empty((len(texts), part.shape[1]), dtype=np.float32)
+            out[start:start + part.shape[0]] = part
+        return out
+
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, calling the API only for cache misses."""
+        if self.embedding_cache is None:
+            return self.embedding_provider.embed(texts)
+
+        keys = [text_key(t) for t in texts]
+        cached = self.embedding_cache.get_many(self.embedding_model, keys)
+        # Embed each distinct missing text once
+        miss_first: Dict[str, int] = {}
+        for i, key in enumerate(keys):
+            if key not in cached and key not in miss_first:
+                miss_first[key] = i
+        if miss_first:
+            miss_keys = list(miss_first)
+            # Batched, concurrent embedding within provider limits
+            fresh = self.embedding_provider.embed([texts[miss_first[k]] for k in miss_keys])
+            self.embedding_cache.put_many(self.embedding_model, miss_keys, fresh)
+            cached.update(zip(miss_keys, fresh))
+        return np.stack([cached[k] for k in keys]).astype(np.float32, copy=False)
+
+    def _build_relations(self, chunks: ChunkStore) -> RelationGraph:
+        """Same-page line-neighborhood relations of `chunks` within relation_window_default."""
+        return RelationGraph.build(chunks.pages, chunks.lines, self.relation_window_default)
+
+    # --------------- Querying ---------------
+    NO_CONTENT_ANSWER = "No indexed content. Please index recognition JSON first."
+
+    def query(self, question: str, max_sources: int = 3, include_relations: Optional[bool] = None, relation_window: Optional[int] = None, max_group_items: int = 5, mode: Optional[str] = None) -> Dict[str, Any]:
+        state = self._state
+        if not state.chunks:
+            return {"answer": self.NO_CONTENT_ANSWER, "sources": []}
+
+        mode = self._resolve_mode(mode)
+        version, params = state.version, (max_sources, include_relations, relation_window, max_group_items, mode)
+        key, hit = self._cached_exact(version, question, params)
+        if hit is not None:
+            return hit
+        q_emb = q_vec = None
+        if mode != "lexical":
+            q_emb = self._embed_query(question)
+            q_vec, hit = self._cached_similar(version, params, q_emb)
+            if hit is not None:
+                return hit
+
+        contributions, prompt = self._build_context(
+            state, question, q_emb, max_sources, include_relations, relation_window, max_group_items, mode
+        )
+        answer = self._complete(prompt)
+
+        result = {"answer": answer, "sources": contributions}
+        self._cache_put(version, key, params, q_vec, result)
+        return result
+
+    async def aquery(self, question: str, max_sources: int = 3, include_relations: Optional[bool] = None, relation_window: Optional[int] = None, max_group_items: int = 5, mode: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of query: both network round trips use the non-blocking client.
 
-    def _embed_all(self) -> None:
-        texts = [c.text for c in self._chunks]
-        # Guard: OpenAI client requires non-empty input
-        if not texts:
+        Retrieval and context packing (matrix products, lazy index builds) run in a
+        worker thread so one cold query does not stall the event loop.
+        """
+        state = self._state
+        if not state.chunks:
+            return {"answer": self.NO_CONTENT_ANSWER, "sources": []}
+
+        mode = self._resolve_mode(mode)
+        version, params = state.version, (max_sources, include_relations, relation_window, max_group_items, mode)
+        key, hit = self._cached_exact(version, question, params)
+        if hit is not None:
+            return hit
+        q_emb = q_vec = None
+        if mode != "lexical":
+            q_emb = await self._aembed_query(question)
+            q_vec, hit = self._cached_similar(version, params, q_emb)
+            if hit is not None:
+                return hit
+
+        contributions, prompt = await asyncio.to_thread(
+            self._build_context,
+            state, question, q_emb, max_sources, include_relations, relation_window, max_group_items, mode,
+        )
+        answer = await self._acomplete(prompt)
+
+        result = {"answer": answer, "sources": contributions}
+        self._cache_put(version, key, params, q_vec, result)
+        return result
+
+    async def astream_query(self, question: str, max_sources: int = 3, include_relations: Optional[bool] = None, relation_window: Optional[int] = None, max_group_items: int = 5, mode: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a grounded answer as events:
+        {"type": "sources", ...} as soon as retrieval finishes, then {"type": "token", "text": ...}
+        per generated delta, and finally {"type": "done", "answer": <full text>}.
+        """
+        state = self._state
+        if not state.chunks:
+            yield {"type": "sources", "sources": []}
+            yield {"type": "done", "answer": self.NO_CONTENT_ANSWER}
             return
-        # Batch embedding
-        resp = self.client.embeddings.create(model=self.embedding_model, input=texts)
-        for chunk, data in zip(self._chunks, resp.data):
-            chunk.embedding = data.embedding
-
-    def _rebuild_page_index(self) -> None:
-        self._page_index.clear()
-        for i, c in enumerate(self._chunks):
-            self._page_index.setdefault(c.page, []).append(i)
-        # Build simple line-neighborhood relations per page
-        self._rebuild_relations()
-
-    def _rebuild_relations(self) -> None:
-        self._relations.clear()
-        # Group indices by page
-        by_page: Dict[int, List[Tuple[int, int]]] = {}
-        for idx, c in enumerate(self._chunks):
-            by_page.setdefault(c.page, []).append((idx, c.line))
-        for page, pairs in by_page.items():
-            pairs.sort(key=lambda x: x[1])
-            # For each chunk, add neighbors within relation_window_default
-            for i, (idx, line) in enumerate(pairs):
-                neighbors: List[int] = []
-                # look left
-                j = i - 1
-                while j >= 0 and abs(pairs[j][1] - line) <= self.relation_window_default:
-                    neighbors.append(pairs[j][0])
-                    j -= 1
-                # look right
-                k = i + 1
-                while k < len(pairs) and abs(pairs[k][1] - line) <= self.relation_window_default:
-                    neighbors.append(pairs[k][0])
-                    k += 1
-                self._relations[idx] = neighbors
 
-    # --------------- Querying ---------------
-    def query(self, question: str, max_sources: int = 3, include_relations: Optional[bool] = None, relation_window: Optional[int] = None, max_group_items: int = 5) -> Dict[str, Any]:
-        if not self._chunks:
-            return {"answer": "No indexed content. Please index recognition JSON first.", "sources": []}
+        mode = self._resolve_mode(mode)
+        version, params = state.version, (max_sources, include_relations, relation_window, max_group_items, mode)
+        key, hit = self._cached_exact(version, question, params)
+        q_emb = q_vec = None
+        if hit is None and mode != "lexical":
+            q_emb = await self._aembed_query(question)
+            q_vec, hit = self._cached_similar(version, params, q_emb)
+        if hit is not None:
+            yield {"type": "sources", "sources": hit["sources"]}
+            yield {"type": "token", "text": hit["answer"]}
+            yield {"type": "done", "answer": hit["answer"]}
+            return
 
+        contributions, prompt = await asyncio.to_thread(
+            self._build_context,
+            state, question, q_emb, max_sources, include_relations, relation_window, max_group_items, mode,
+        )
+        yield {"type": "sources", "sources": contributions}
+
+        parts: List[str] = []
+        args = self._completion_args(prompt)
+        stream = await self.async_client.chat.completions.create(**args, stream=True)
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield {"type": "token", "text": delta}
+        answer = "".join(parts)
+        self._cache_put(version, key, params, q_vec, {"answer": answer, "sources": contributions})
+        yield {"type": "done", "answer": answer}
+
+    def query_many(self, questions: List[str], max_sources: int = 3, include_relations: Optional[bool] = None, relation_window: Optional[int] = None, max_group_items: int = 5, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Answer several questions in one pass; results are in input order.
+        Cache misses are embedded as one batch, vector retrieval is a single
+        matrix-matrix product, and completions run QUERY_BATCH_CONCURRENCY at a time.
+        """
+        state = self._state
+        if not state.chunks:
+            return [{"answer": self.NO_CONTENT_ANSWER, "sources": []} for _ in questions]
+        batch = _QueryBatch(self, state, questions, self._resolve_mode(mode), max_sources, include_relations, relation_window, max_group_items)
+        if batch.todo and batch.mode != "lexical":
+            futures = [self.query_embedder.submit(questions[i]) for i in batch.todo]
+            batch.set_embeddings([f.result() for f in futures])
+        prompts = batch.build_prompts()
+        if not prompts:
+            return batch.finish([])
+        with ThreadPoolExecutor(max_workers=min(self.batch_concurrency, len(prompts))) as pool:
+            answers = list(pool.map(self._complete, prompts))
+        return batch.finish(answers)
+
+    async def aquery_many(self, questions: List[str], max_sources: int = 3, include_relations: Optional[bool] = None, relation_window: Optional[int] = None, max_group_items: int = 5, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Async variant of query_many; completions are bounded by a semaphore."""
+        state = self._state
+        if not state.chunks:
+            return [{"answer": self.NO_CONTENT_ANSWER, "sources": []} for _ in questions]
+        batch = _QueryBatch(self, state, questions, self._resolve_mode(mode), max_sources, include_relations, relation_window, max_group_items)
+        if batch.todo and batch.mode != "lexical":
+            # Submitted together, so the micro-batcher sends them as one embeddings call
+            futures = [self.query_embedder.submit(questions[i]) for i in batch.todo]
+            batch.set_embeddings(await asyncio.gather(*(asyncio.wrap_future(f) for f in futures)))
+        prompts = await asyncio.to_thread(batch.build_prompts)
+        limit = asyncio.Semaphore(self.batch_concurrency)
+
+        async def complete(prompt: str) -> str:
+            async with limit:
+                return await self._acomplete(prompt)
+
+        answers = await asyncio.gather(*(complete(p) for p in prompts))
+        return batch.finish(list(answers))
+
+    def search(self, question: str, max_sources: int = 3, include_relations: Optional[bool] = None, relation_window: Optional[int] = None, max_group_items: int = 5, mode: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Retrieval only: return source contributions without generating an answer.
+        In lexical mode this makes no network call at all.
+        """
+        state = self._state
+        if not state.chunks:
+            return {"sources": []}
+        mode = self._resolve_mode(mode)
+        q_emb = self._embed_query(question) if mode != "lexical" else None
+        contributions, _ = self._build_context(
+            state, question, q_emb, max_sources, include_relations, relation_window, max_group_items, mode
+        )
+        return {"sources": contributions}
+
+    def _resolve_mode(self, mode: Optional[str]) -> str:
+        mode = (mode or self.retrieval_mode_default).lower()
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode!r}; expected one of {', '.join(RETRIEVAL_MODES)}")
+        return mode
+
+    def _cached_exact(self, version: int, question: str, params: Tuple) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        if self.answer_cache is None:
+            return None, None
+        key = self.answer_cache.exact_key(question, params)
+        return key, self.answer_cache.get_exact(version, key)
+
+    def _cached_similar(self, version: int, params: Tuple, q_emb: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[Dict[str, Any]]]:
+        if self.answer_cache is None:
+            return None, None
+        q_vec = np.asarray(q_emb, dtype=np.float32)
+        q_vec = q_vec / (np.linalg.norm(q_vec) or 1e-9)
+        return q_vec, self.answer_cache.get_similar(version, params, q_vec)
+
+    def _cache_put(self, version: int, key: Any, params: Tuple, q_vec: Optional[np.ndarray], result: Dict[str, Any]) -> None:
+        if self.answer_cache is not None:
+            self.answer_cache.put(version, key, params, q_vec, result)
+
+    def _build_context(
+        self,
+        state: _IndexState,
+        question: str,
+        q_emb: Optional[np.ndarray],
+        max_sources: int,
+        include_relations: Optional[bool],
+        relation_window: Optional[int],
+        max_group_items: int,
+        mode: str = "vector",
+        seeds: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> Tuple[List[Dict[str, Any]], str]:
+        """Retrieve seeds (unless given) and related neighbors from one index state; return (source contributions, answer prompt)."""
         include_rel = include_relations if include_relations is not None else self.include_relations_default
         rel_win = relation_window if relation_window is not None else self.relation_window_default
 
-        q_emb = self._embed_query(question)
-        scored = self._score_chunks(q_emb)
-        seeds = scored[:max_sources]
+        if seeds is None:
+            seeds = self._retrieve(state, question, q_emb, max_sources, mode)
+        seed_ids, seed_scores = seeds
 
-        # Build context from seeds and their related neighbors
-        total_weight = 0.0
-        contributions = []
-        context_parts = []
+        # Group seeds with their related neighbors, working on row ids
+        # and the store's columns rather than chunk objects
+        texts, pages, lines = state.chunks.texts, state.chunks.pages, state.chunks.lines
+        candidates = []
         used_indices: set[int] = set()
 
-        def neighbor_weight(delta_line: int) -> float:
-            # decay by line distance
-            import math
-            return math.exp(-0.3 * abs(delta_line))
-
-        for (chunk, sim) in seeds:
+        for seed_idx, sim in zip(seed_ids.tolist(), seed_scores.tolist()):
             # representative
-            seed_idx = self._chunks.index(chunk)
             if seed_idx in used_indices:
                 continue
             used_indices.add(seed_idx)
-            group_weight = sim
+            page, line = int(pages[seed_idx]), int(lines[seed_idx])
             related_items = []
             if include_rel:
-                # collect neighbors within rel_win
-                for n_idx in self._relations.get(seed_idx, []):
+                # collect neighbors within rel_win, weighted by decay over line distance
+                nbrs, deltas = state.relations.neighbors(seed_idx)
+                keep = deltas <= rel_win
+                nbrs, deltas = nbrs[keep], deltas[keep]
+                weights = np.exp(-0.3 * deltas) * sim
+                for n_idx, w in zip(nbrs.tolist(), weights.tolist()):
                     if n_idx in used_indices:
                         continue
-                    n = self._chunks[n_idx]
-                    if abs(n.line - chunk.line) <= rel_win and n.page == chunk.page:
-                        w = neighbor_weight(n.line - chunk.line) * sim
-                        related_items.append({
-                            "page": n.page,
-                            "line": n.line,
-                            "score": w,
-                            "text": n.text,
-                        })
-                        group_weight += w
-                        used_indices.add(n_idx)
-                        if len(related_items) >= max_group_items:
-                            break
-
-            total_weight += group_weight
-            contributions.append({
-                "page": chunk.page,
-                "line": chunk.line,
-                "score": group_weight,
-                "text": chunk.text,
-                "related": related_items if include_rel else [],
-            })
-            # Build context with representative and neighbors
-            group_ctx = [f"[Page {chunk.page}, Line {chunk.line}] {chunk.text}"]
-            for r in related_items:
-                group_ctx.append(f"[Page {r['page']}, Line {r['line']}] {r['text']}")
-            context_parts.append("\n".join(group_ctx))
+                    related_items.append({
+                        "page": page,
+                        "line": int(lines[n_idx]),
+                        "score": w,
+                        "text": texts[n_idx],
+                    })
+                    used_indices.add(n_idx)
+                    if len(related_items) >= max_group_items:
+                        break
+            candidates.append((sim, {
+                "page": page,
+                "line": line,
+                "text": texts[seed_idx],
+                "related": related_items,
+            }))
+
+        # Greedily pack the highest-weight groups into the prompt's token budget,
+        # skipping neighbor text that repeats what is already in context
+        group_lines = [
+            [(c["text"], f"[Page {c['page']}, Line {c['line']}] {c['text']}")]
+            + [(r["text"], f"[Page {r['page']}, Line {r['line']}] {r['text']}") for r in c["related"]]
+            for _, c in candidates
+        ]
+        group_weights = [sim + sum(r["score"] for r in c["related"]) for sim, c in candidates]
+        budget = self.context_token_budget - self._count_tokens(ANSWER_PROMPT.format(context="", question=question))
+        kept = pack_context(group_lines, group_weights, budget, self._count_tokens)
+
+        total_weight = 0.0
+        contributions = []
+        context_parts = []
+        for (sim, c), packed in zip(candidates, kept):
+            if not packed:
+                continue
+            c["related"] = [c["related"][pos - 1] for pos, _ in packed[1:]]
+            c["score"] = sim + sum(r["score"] for r in c["related"])
+            total_weight += c["score"]
+            contributions.append(c)
+            context_parts.append("\n".join(line for _, line in packed))
 
         # Normalize to percentages
         for c in contributions:
             c["percent"] = round((c["score"] / (total_weight or 1e-9)) * 100)
 
-        context = "\n\n".join(context_parts)
-        prompt = (
-            "You are a helpful assistant. Answer the user based ONLY on the provided context. "
-            "If the answer is not in context, say you cannot find it in the document.\n\n"
-            f"Context:\n{context}\n\n"
-            f"Question: {question}"
-        )
+        prompt = ANSWER_PROMPT.format(context="\n\n".join(context_parts), question=question)
+        return contributions, prompt
 
-        completion = self.client.chat.completions.create(
-            model=self.answer_model,
-            messages=[
+    def _completion_args(self, prompt: str) -> Dict[str, Any]:
+        if self.client is None and self.async_client is None:
+            raise RuntimeError("Answer generation needs OPENAI_API_KEY; use search() for retrieval-only access.")
+        return {
+            "model": self.answer_model,
+            "messages": [
                 {"role": "system", "content": "You ground answers strictly in provided context."},
                 {"role": "user", "content": prompt},
             ],
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-        )
-        answer = completion.choices[0].message.content
-
-        return {"answer": answer, "sources": contributions}
-
-    def _embed_query(self, question: str) -> List[float]:
-        resp = self.client.embeddings.create(model=self.embedding_model, input=[question])
-        return resp.data[0].embedding
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+        }
+
+    def _complete(self, prompt: str) -> str:
+        args = self._completion_args(prompt)
+        completion = self.client.chat.completions.create(**args)
+        return completion.choices[0].message.content
+
+    async def _acomplete(self, prompt: str) -> str:
+        args = self._completion_args(prompt)
+        completion = await self.async_client.chat.completions.create(**args)
+        return completion.choices[0].message.content
+
+    def _embed_query(self, question: str) -> np.ndarray:
+        return self.query_embedder.embed(question)
+
+    async def _aembed_query(self, question: str) -> np.ndarray:
+        return await self.query_embedder.aembed(question)
+
+    def _vector_index(self, state: _IndexState) -> VectorIndex:
+        # Published states come with their indexes; only the initial empty state builds lazily
+        if state.vindex is None:
+            with self._vindex_lock:
+                if state.vindex is None:
+                    state.vindex = make_vector_index(state.embeddings.shape[0]).build(state.embeddings)
+        return state.vindex
+
+    def _lexical_index(self, state: _IndexState) -> BM25Index:
+        if state.bm25 is None:
+            with self._vindex_lock:
+                if state.bm25 is None:
+                    state.bm25 = BM25Index().build(state.chunks.texts)
+        return state.bm25
+
+    def _retrieve(self, state: _IndexState, question: str, q_emb: Optional[np.ndarray], k: int, mode: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k seed (row ids, scores), best first: vector, BM25 (lexical) or RRF-fused hybrid."""
+        if mode == "vector":
+            return self._vector_search(state, q_emb, k)
+        if mode == "lexical":
+            return self._lexical_index(state).search(question, k)
+        # Fuse a wider candidate pool from each retriever, then keep the top k
+        pool = max(4 * k, 20)
+        v_ids, _ = self._vector_search(state, q_emb, pool)
+        l_ids, _ = self._lexical_index(state).search(question, pool)
+        return reciprocal_rank_fusion([v_ids, l_ids], k)
+
+    def _retrieve_many(self, state: _IndexState, questions: List[str], q_embs: List[Optional[np.ndarray]], k: int, mode: str) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """_retrieve for several questions; the vector side is one search_many call."""
+        if not questions:
+            return []
+        if mode == "lexical":
+            return [self._lexical_index(state).search(q, k) for q in questions]
+        pool = k if mode == "vector" else max(4 * k, 20)
+        if state.embeddings.shape[0] == 0 or pool <= 0:
+            empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+            vector = [empty] * len(questions)
+        else:
+            queries = np.stack([np.asarray(q, dtype=np.float32) for q in q_embs])
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            norms[norms == 0] = 1e-9
+            vector = self._vector_index(state).search_many(queries / norms, pool)
+        if mode == "vector":
+            return vector
+        return [
+            reciprocal_rank_fusion([v_ids, self._lexical_index(state).search(q, pool)[0]], k)
+            for q, (v_ids, _) in zip(questions, vector)
+        ]
+
+    def _vector_search(self, state: _IndexState, q_emb: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row ids, cosine similarities) of the top-k chunks, best first."""
+        if state.embeddings.shape[0] == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        q = np.asarray(q_emb, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1e-9)
+        return self._vector_index(state).search(q, k)
+
+
+class _QueryBatch:
+    """
+    Bookkeeping for query_many / aquery_many: exact-cache hits and in-batch duplicates
+    are resolved up front, the rest go through (batched) embedding and retrieval.
+    """
 
-    def _score_chunks(self, q_emb: List[float]) -> List[Tuple[SourceChunk, float]]:
-        scored: List[Tuple[SourceChunk, float]] = []
-        q_norm = self._norm(q_emb)
-        for c in self._chunks:
-            if not c.embedding:
+    def __init__(self, svc: RagService, state: _IndexState, questions: List[str], mode: str, max_sources: int, include_relations: Optional[bool], relation_window: Optional[int], max_group_items: int) -> None:
+        self.svc = svc
+        self.state = state
+        self.questions = questions
+        self.mode = mode
+        self.max_sources = max_sources
+        self.include_relations = include_relations
+        self.relation_window = relation_window
+        self.max_group_items = max_group_items
+        self.params = (max_sources, include_relations, relation_window, max_group_items, mode)
+        self.version = state.version
+        n = len(questions)
+        self.results: List[Optional[Dict[str, Any]]] = [None] * n
+        self.keys: List[Any] = [None] * n
+        self.q_vecs: List[Optional[np.ndarray]] = [None] * n
+        self.embs: List[Optional[np.ndarray]] = [None] * n
+        self.contributions: List[List[Dict[str, Any]]] = []
+        # Repeated questions are answered once and share the result
+        self.first = list(range(n))
+        seen: Dict[str, int] = {}
+        self.todo: List[int] = []
+        for i, q in enumerate(questions):
+            self.first[i] = seen.setdefault(normalize_question(q), i)
+            if self.first[i] != i:
                 continue
-            sim = self._cosine(q_emb, c.embedding, q_norm, self._norm(c.embedding))
-            scored.append((c, sim))
-        scored.sort(key=lambda x: x[1], reverse=True)
-        return scored
-
-    @staticmethod
-    def _norm(vec: List[float]) -> float:
-        return math.sqrt(sum((v * v) for v in vec)) or 1e-9
+            self.keys[i], self.results[i] = svc._cached_exact(self.version, q, self.params)
+            if self.results[i] is None:
+                self.todo.append(i)
+
+    def set_embeddings(self, vectors: List[np.ndarray]) -> None:
+        remaining = []
+        for i, vec in zip(self.todo, vectors):
+            self.embs[i] = vec
+            self.q_vecs[i], self.results[i] = self.svc._cached_similar(self.version, self.params, vec)
+            if self.results[i] is None:
+                remaining.append(i)
+        self.todo = remaining
+
+    def build_prompts(self) -> List[str]:
+        questions = [self.questions[i] for i in self.todo]
+        seeds = self.svc._retrieve_many(self.state, questions, [self.embs[i] for i in self.todo], self.max_sources, self.mode)
+        prompts = []
+        for i, question, seed in zip(self.todo, questions, seeds):
+            contributions, prompt = self.svc._build_context(
+                self.state, question, self.embs[i], self.max_sources, self.include_relations, self.relation_window,
+                self.max_group_items, self.mode, seeds=seed,
+            )
+            self.contributions.append(contributions)
+            prompts.append(prompt)
+        return prompts
 
-    @staticmethod
-    def _cosine(a: List[float], b: List[float], a_norm: float, b_norm: float) -> float:
-        dot = 0.0
-        # Assumes equal length
-        for x, y in zip(a, b):
-            dot += x * y
-        return dot / (a_norm * b_norm)
+    def finish(self, answers: List[str]) -> List[Dict[str, Any]]:
+        for i, contributions, answer in zip(self.todo, self.contributions, answers):
+            self.results[i] = {"answer": answer, "sources": contributions}
+            self.svc._cache_put(self.version, self.keys[i], self.params, self.q_vecs[i], self.results[i])
+        return [self.results[j] for j in self.first]
 
 
 # --------- Convenience helpers for api_outputs ---------
@@ -352,28 +956,46 @@ def find_latest_recognition_dir(api_outputs_dir: str) -> Optional[str]:
     api_outputs_dir = os.path.abspath(api_outputs_dir)
     if not os.path.isdir(api_outputs_dir):
         return None
-    run_dirs = [d for d in glob.glob(os.path.join(api_outputs_dir, "run_*")) if os.path.isdir(d)]
-    if not run_dirs:
-        return None
-    run_dirs.sort(key=lambda p: os.path.getmtime(p), reverse=True)
+    # O(1): the API points latest_run.json at each run it finishes
+    run_dir = rag_manifest.read_latest_run(api_outputs_dir)
+    if run_dir is None:
+        # No pointer yet: run_YYYYMMDD_HHMMSS names sort chronologically, so take the
+        # greatest name instead of stat-ing every run directory
+        with os.scandir(api_outputs_dir) as entries:
+            names = [e.name for e in entries if e.name.startswith("run_") and e.is_dir()]
+        if not names:
+            return None
+        run_dir = os.path.join(api_outputs_dir, max(names))
     # Try common subdir name
-    candidate = os.path.join(run_dirs[0], "recognition_json")
+    candidate = os.path.join(run_dir, "recognition_json")
     return candidate if os.path.isdir(candidate) else None
 
 
-def build_service_from_latest(base_dir: str) -> Optional[RagService]:
+def build_service_from_latest(base_dir: str, index: Optional[str] = None, **kwargs: Any) -> Optional[RagService]:
     """
     Create and index a RagService from the latest recognition_json directory.
+    Extra keyword arguments (models, embedding provider, ...) go to RagService.
     Returns None if not found.
     """
     recognition_dir = find_latest_recognition_dir(os.path.join(base_dir, "api_outputs"))
     if not recognition_dir:
         return None
-    svc = RagService()
+    svc = RagService(snapshot_dir=rag_snapshot.index_snapshot_dir(base_dir, index), **kwargs)
     svc.index_recognition_dir(recognition_dir)
     return svc
 
 
+def load_latest_snapshot(base_dir: str, index: Optional[str] = None) -> Optional[RagService]:
+    """
+    Restore the last persisted index (see RAG_SNAPSHOT_DIR) without re-indexing.
+    Returns None if no snapshot exists.
+    """
+    snapshot_dir = rag_snapshot.index_snapshot_dir(base_dir, index)
+    if not rag_snapshot.has_snapshot(snapshot_dir):
+        return None
+    return RagService.from_snapshot(snapshot_dir)
+
+
 if __name__ == "__main__":
     # Example CLI usage (quick test):
     base = os.path.dirname(__file__)  # D:\1project2026\RAG_advanced\Dolphin
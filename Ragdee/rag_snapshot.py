@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import shutil
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag_relations import RelationGraph
+from rag_vector_index import IVFIndex
+
+
+SNAPSHOT_VERSION = 4
+INFO_FILE = "snapshot.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.npz"
+RELATIONS_FILE = "relations.npz"
+IVF_FILE = "ivf.npz"
+SNAPSHOT_FILES = (INFO_FILE, EMBEDDINGS_FILE, CHUNKS_FILE, RELATIONS_FILE, IVF_FILE)
+# Names the version directory that holds the current snapshot
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v-"
+# Superseded versions kept besides the current one, for readers in other processes
+# that resolved CURRENT just before it moved
+KEEP_PREVIOUS = 1
+
+# Version directory -> embedding matrices of this process still memory-mapped from it
+_mapped: Dict[str, int] = {}
+_mapped_lock = threading.Lock()
+
+
+def default_snapshot_dir(base_dir: str) -> str:
+    return os.getenv("RAG_SNAPSHOT_DIR", os.path.join(base_dir, "api_outputs", "rag_index"))
+
+
+def index_snapshot_dir(base_dir: str, index: Optional[str] = None) -> str:
+    """Snapshot location for a named index; the unnamed/default index keeps RAG_SNAPSHOT_DIR."""
+    root = default_snapshot_dir(base_dir)
+    if not index or index == "default":
+        return root
+    return os.path.join(os.path.dirname(root), "rag_indexes", index)
+
+
+def current_version_dir(snapshot_dir: str) -> Optional[str]:
+    """
+    Directory holding the current snapshot: the version named by CURRENT, or
+    snapshot_dir itself for snapshots written before versioning. None if there is none.
+    """
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        name = ""
+    if name and os.path.isfile(os.path.join(snapshot_dir, name, INFO_FILE)):
+        return os.path.join(snapshot_dir, name)
+    if os.path.isfile(os.path.join(snapshot_dir, INFO_FILE)):
+        return snapshot_dir
+    return None
+
+
+def has_snapshot(snapshot_dir: str) -> bool:
+    return current_version_dir(snapshot_dir) is not None
+
+
+def _version_dir(snapshot_dir: str) -> str:
+    version_dir = current_version_dir(snapshot_dir)
+    if version_dir is None:
+        raise FileNotFoundError(f"No snapshot in {snapshot_dir}")
+    return version_dir
+
+
+def read_snapshot_info(snapshot_dir: str) -> Dict[str, Any]:
+    snapshot_dir = _version_dir(snapshot_dir)
+    with open(os.path.join(snapshot_dir, INFO_FILE), "r", encoding="utf-8") as f:
+        info = json.load(f)
+    if info.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {info.get('version')} in {snapshot_dir}")
+    return info
+
+
+def encode_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack strings into one UTF-8 blob plus int64 offsets (len(values) + 1 entries)."""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    raw = blob.tobytes()
+    bounds = offsets.tolist()
+    return [raw[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(len(bounds) - 1)]
+
+
+def write_snapshot(
+    snapshot_dir: str,
+    info: Dict[str, Any],
+    embeddings: np.ndarray,
+    texts: List[str],
+    pages: np.ndarray,
+    lines: np.ndarray,
+    source_ids: np.ndarray,
+    ordinals: np.ndarray,
+    relations: RelationGraph,
+    ivf: Optional[IVFIndex] = None,
+) -> str:
+    """
+    Write an index snapshot to snapshot_dir (with the trained IVF cells, if given).
+
+    Each snapshot goes to a new version directory and becomes current when the CURRENT
+    pointer file is replaced, so a reader never observes a half-written snapshot and no
+    directory is renamed or deleted while a service still memory-maps its embeddings
+    (which fails on Windows). Superseded versions are pruned once nothing maps them.
+    """
+    snapshot_dir = os.path.abspath(snapshot_dir)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    version = f"{VERSION_PREFIX}{time.time_ns()}-{os.getpid()}"
+    tmp_dir = os.path.join(snapshot_dir, version)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), np.ascontiguousarray(embeddings, dtype=np.float32))
+    text_blob, text_offsets = encode_strings(texts)
+    np.savez(
+        os.path.join(tmp_dir, CHUNKS_FILE),
+        page=np.asarray(pages, dtype=np.int32),
+        line=np.asarray(lines, dtype=np.int32),
+        source=np.asarray(source_ids, dtype=np.int32),
+        ordinal=np.asarray(ordinals, dtype=np.int32),
+        text_blob=text_blob,
+        text_offsets=text_offsets,
+    )
+    np.savez(
+        os.path.join(tmp_dir, RELATIONS_FILE),
+        indptr=relations.indptr,
+        indices=relations.indices,
+        deltas=relations.deltas,
+        window=np.int64(relations.window),
+    )
+    if ivf is not None:
+        np.savez(
+            os.path.join(tmp_dir, IVF_FILE),
+            centroids=ivf.centroids,
+            list_ids=ivf.list_ids,
+            list_offsets=ivf.list_offsets,
+        )
+
+    info = dict(info, version=SNAPSHOT_VERSION, count=len(texts), dim=int(embeddings.shape[1]) if embeddings.ndim == 2 else 0, created=time.time())
+    with open(os.path.join(tmp_dir, INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+    pointer_tmp = os.path.join(snapshot_dir, f"{CURRENT_FILE}.tmp-{os.getpid()}")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(snapshot_dir, CURRENT_FILE))
+    prune_snapshots(snapshot_dir)
+    return snapshot_dir
+
+
+def prune_snapshots(snapshot_dir: str) -> None:
+    """
+    Delete superseded versions (beyond KEEP_PREVIOUS) that this process no longer maps.
+    Versions still open elsewhere (e.g. another worker on Windows) fail to delete and
+    are retried on the next write.
+    """
+    current = current_version_dir(snapshot_dir)
+    versions = sorted(
+        (name for name in os.listdir(snapshot_dir)
+         if name.startswith(VERSION_PREFIX) and os.path.join(snapshot_dir, name) != current),
+        key=lambda name: int(name[len(VERSION_PREFIX):].split("-")[0]),
+    )
+    stale = [os.path.join(snapshot_dir, name) for name in versions[:max(0, len(versions) - KEEP_PREVIOUS)]]
+    with _mapped_lock:
+        stale = [d for d in stale if not _mapped.get(d)]
+        legacy = current != snapshot_dir and not _mapped.get(snapshot_dir)
+    for version_dir in stale:
+        shutil.rmtree(version_dir, ignore_errors=True)
+    if legacy:
+        # Files of a snapshot written before versioning
+        for name in SNAPSHOT_FILES:
+            try:
+                os.remove(os.path.join(snapshot_dir, name))
+            except OSError:
+                pass
+
+
+def _track_mapping(version_dir: str, embeddings: np.ndarray) -> None:
+    """Count a memory map until it (and every view of it) is garbage collected."""
+    with _mapped_lock:
+        _mapped[version_dir] = _mapped.get(version_dir, 0) + 1
+    weakref.finalize(embeddings, _release_mapping, version_dir)
+
+
+def _release_mapping(version_dir: str) -> None:
+    with _mapped_lock:
+        _mapped[version_dir] -= 1
+        if not _mapped[version_dir]:
+            del _mapped[version_dir]
+
+
+def read_snapshot(snapshot_dir: str) -> Dict[str, Any]:
+    """
+    Load a snapshot. The embedding matrix is memory-mapped read-only, so it is paged in
+    on demand and shared through the OS page cache by every worker process.
+    """
+    snapshot_dir = _version_dir(snapshot_dir)
+    info = read_snapshot_info(snapshot_dir)
+    embeddings = np.load(os.path.join(snapshot_dir, EMBEDDINGS_FILE), mmap_mode="r")
+    _track_mapping(snapshot_dir, embeddings)
+    with np.load(os.path.join(snapshot_dir, CHUNKS_FILE)) as chunks:
+        pages = chunks["page"]
+        lines = chunks["line"]
+        source_ids = chunks["source"]
+        ordinals = chunks["ordinal"]
+        texts = decode_strings(chunks["text_blob"], chunks["text_offsets"])
+    with np.load(os.path.join(snapshot_dir, RELATIONS_FILE)) as rel:
+        relations = RelationGraph(rel["indptr"], rel["indices"], rel["deltas"], int(rel["window"]))
+    ivf = None
+    ivf_path = os.path.join(snapshot_dir, IVF_FILE)
+    if os.path.isfile(ivf_path):
+        with np.load(ivf_path) as cells:
+            if cells["list_ids"].shape[0] == embeddings.shape[0]:
+                ivf = IVFIndex().restore(embeddings, cells["centroids"], cells["list_ids"], cells["list_offsets"])
+    return {
+        "info": info,
+        "embeddings": embeddings,
+        "texts": texts,
+        "pages": pages,
+        "lines": lines,
+        "source_ids": source_ids,
+        "ordinals": ordinals,
+        "relations": relations,
+        "ivf": ivf,
+    }
@@ -0,0 +1,213 @@
+import os
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class VectorIndex:
+    """
+    Nearest-neighbour search over a matrix of L2-normalized float32 rows.
+
+    Scores are inner products (cosine similarity for normalized inputs).
+    `search` returns (ids, scores) for the best k rows, best first.
+    """
+
+    def build(self, matrix: np.ndarray) -> "VectorIndex":
+        raise NotImplementedError
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def search_many(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """`search` for each row of a (m, d) query matrix."""
+        return [self.search(q, k) for q in queries]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Positions of the k largest scores, sorted descending (argpartition, no full sort)."""
+        n = scores.shape[0]
+        k = min(k, n)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+        return top[np.argsort(-scores[top], kind="stable")]
+
+
+class ExactIndex(VectorIndex):
+    """Brute-force search: one matrix-vector product plus top-k selection."""
+
+    def __init__(self) -> None:
+        self.matrix: np.ndarray = np.zeros((0, 0), dtype=np.float32)
+
+    def build(self, matrix: np.ndarray) -> "ExactIndex":
+        self.matrix = matrix
+        return self
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.matrix.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        sims = self.matrix @ q
+        top = self._top_k(sims, k)
+        return top, sims[top]
+
+    def search_many(self, queries: np.ndarray, k: int, block_elems: int = 1 << 24) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """One matrix-matrix product per block of queries, with row-wise top-k selection."""
+        n, m = self.matrix.shape[0], queries.shape[0]
+        k = min(k, n)
+        if n == 0 or k <= 0:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in range(m)]
+        # Bound the (block, n) score matrix to ~block_elems floats
+        step = max(1, block_elems // n)
+        out: List[Tuple[np.ndarray, np.ndarray]] = []
+        for start in range(0, m, step):
+            sims = queries[start:start + step] @ self.matrix.T
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k] if k < n else np.broadcast_to(np.arange(n), sims.shape)
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_sims, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_sims = np.take_along_axis(top_sims, order, axis=1)
+            out.extend((top[r].astype(np.int64), top_sims[r]) for r in range(top.shape[0]))
+        return out
+
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted-file index: spherical k-means partitions rows into `nlist` cells and a
+    query only scans the `nprobe` closest cells.
+
+    - Raising nprobe trades latency for recall (nprobe == nlist is exact search).
+    - Cells are stored CSR-style (row ids sorted by cell + offsets) to keep memory flat.
+    - Training uses a capped sample (IVF_TRAIN_SAMPLE rows) and every row-to-centroid
+      assignment is computed in blocks, so memory does not grow with the corpus.
+    - `update` keeps the trained centroids for small edits and only assigns the new rows;
+      it retrains once appended rows exceed IVF_RETRAIN_FRACTION of the index.
+    """
+
+    def __init__(
+        self,
+        nlist: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        train_iters: Optional[int] = None,
+        train_sample: Optional[int] = None,
+        seed: int = 0,
+    ) -> None:
+        self.nlist = nlist or int(os.getenv("IVF_NLIST", "0")) or None
+        self.nprobe = nprobe or int(os.getenv("IVF_NPROBE", "16"))
+        self.train_iters = train_iters or int(os.getenv("IVF_TRAIN_ITERS", "8"))
+        self.train_sample = train_sample or int(os.getenv("IVF_TRAIN_SAMPLE", "131072"))
+        self.retrain_fraction = float(os.getenv("IVF_RETRAIN_FRACTION", "0.25"))
+        self.seed = seed
+        self.matrix: np.ndarray = np.zeros((0, 0), dtype=np.float32)
+        self.centroids: np.ndarray = np.zeros((0, 0), dtype=np.float32)
+        self.list_ids: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.list_offsets: np.ndarray = np.zeros(1, dtype=np.int64)
+
+    def build(self, matrix: np.ndarray) -> "IVFIndex":
+        self.matrix = matrix
+        n = matrix.shape[0]
+        if n == 0:
+            return self
+        # Common rule of thumb: ~4 * sqrt(n) cells
+        nlist = min(self.nlist or max(1, int(4 * math.sqrt(n))), n)
+        rng = np.random.default_rng(self.seed)
+
+        # ~64 rows per cell is plenty for k-means, capped so the dense sample copy stays bounded
+        sample_size = min(n, max(nlist, min(nlist * 64, self.train_sample)))
+        sample = np.asarray(matrix[np.sort(rng.choice(n, size=sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            assign = self._nearest(sample, centroids)
+            counts = np.bincount(assign, minlength=nlist)
+            # Per-cell sums via one sort + reduceat (much faster than np.add.at)
+            order = np.argsort(assign, kind="stable")
+            filled = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(sample[order], starts, axis=0)
+            empty = counts == 0
+            # Re-seed empty cells from random samples so every cell stays useful
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1e-9
+            centroids = (sums / norms).astype(np.float32)
+        self.centroids = centroids
+
+        assign = self._nearest(matrix, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        self.list_ids = order.astype(np.int64)
+        self.list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.list_offsets[1:])
+        return self
+
+    def restore(self, matrix: np.ndarray, centroids: np.ndarray, list_ids: np.ndarray, list_offsets: np.ndarray) -> "IVFIndex":
+        """Reuse trained cells (e.g. from a snapshot) instead of running k-means again."""
+        self.matrix = matrix
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_ids = np.asarray(list_ids, dtype=np.int64)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        return self
+
+    def update(self, matrix: np.ndarray, kept: Optional[np.ndarray]) -> "IVFIndex":
+        """
+        Index for `matrix` = rows of the indexed matrix where `kept` is set (None = all),
+        in order, followed by appended rows. Surviving rows keep their cells and only the
+        appended rows are assigned; `self` is left untouched.
+        """
+        n_kept = int(kept.sum()) if kept is not None else self.list_ids.shape[0]
+        added = matrix.shape[0] - n_kept
+        out = IVFIndex(self.nlist, self.nprobe, self.train_iters, self.train_sample, self.seed)
+        if n_kept == 0 or added > self.retrain_fraction * matrix.shape[0]:
+            return out.build(matrix)
+        nlist = self.centroids.shape[0]
+        cell = np.empty(self.list_ids.shape[0], dtype=np.int64)
+        cell[self.list_ids] = np.repeat(np.arange(nlist), np.diff(self.list_offsets))
+        if kept is not None:
+            cell = cell[kept]
+        assign = np.concatenate([cell, self._nearest(matrix[n_kept:], self.centroids)])
+        counts = np.bincount(assign, minlength=nlist)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return out.restore(matrix, self.centroids, np.argsort(assign, kind="stable"), offsets)
+
+    @staticmethod
+    def _nearest(rows: np.ndarray, centroids: np.ndarray, block_elems: int = 1 << 24) -> np.ndarray:
+        """Closest centroid of each row; the (block, nlist) score matrix stays ~block_elems floats."""
+        out = np.empty(rows.shape[0], dtype=np.int64)
+        step = max(1, block_elems // max(1, centroids.shape[0]))
+        for start in range(0, rows.shape[0], step):
+            out[start:start + step] = np.argmax(rows[start:start + step] @ centroids.T, axis=1)
+        return out
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.matrix.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        nprobe = min(self.nprobe, self.centroids.shape[0])
+        cells = self._top_k(self.centroids @ q, nprobe)
+        candidates = np.concatenate(
+            [self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in cells.tolist()]
+        )
+        if candidates.shape[0] < k:
+            # Too few rows in the probed cells; answer exactly rather than return short results
+            return ExactIndex().build(self.matrix).search(q, k)
+        candidates.sort()  # sequential access into (possibly memory-mapped) rows
+        sims = self.matrix[candidates] @ q
+        top = self._top_k(sims, k)
+        return candidates[top], sims[top]
+
+
+def make_vector_index(n: int, kind: Optional[str] = None) -> VectorIndex:
+    """
+    Pick a backend via VECTOR_INDEX (auto | exact | ivf).
+    `auto` uses exact search below ANN_MIN_CHUNKS rows, where brute force is already fast and exact.
+    """
+    kind = (kind or os.getenv("VECTOR_INDEX", "auto")).lower()
+    if kind == "exact":
+        return ExactIndex()
+    if kind == "ivf":
+        return IVFIndex()
+    if kind != "auto":
+        raise ValueError(f"Unknown VECTOR_INDEX: {kind!r} (expected auto, exact or ivf)")
+    min_chunks = int(os.getenv("ANN_MIN_CHUNKS", "50000"))
+    return IVFIndex() if n >= min_chunks else ExactIndex()
@@ -0,0 +1,97 @@
+import json
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from rag_answer_cache import AnswerCache
+from rag_service import RagService
+
+
+def unit(*values):
+    v = np.asarray(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_exact_tier_normalizes_questions_and_evicts_lru():
+    cache = AnswerCache(max_entries=2, ttl_seconds=60, similarity_threshold=0.9)
+    for q in ("first", "second"):
+        cache.put(1, cache.exact_key(q, "p"), "p", None, {"answer": q})
+
+    assert cache.get_exact(1, cache.exact_key("  FIRST ", "p")) == {"answer": "first"}
+    cache.put(1, cache.exact_key("third", "p"), "p", None, {"answer": "third"})
+    # "second" was the least recently used entry
+    assert cache.get_exact(1, cache.exact_key("second", "p")) is None
+    assert cache.get_exact(1, cache.exact_key("first", "other params")) is None
+
+
+def test_entries_expire_after_ttl():
+    cache = AnswerCache(max_entries=4, ttl_seconds=0.01, similarity_threshold=0.9)
+    key = cache.exact_key("q", "p")
+    cache.put(1, key, "p", unit(1, 0), {"answer": "a"})
+    time.sleep(0.02)
+
+    assert cache.get_exact(1, key) is None
+    assert cache.get_similar(1, "p", unit(1, 0)) is None
+
+
+def test_semantic_tier_threshold_and_params():
+    cache = AnswerCache(max_entries=4, ttl_seconds=60, similarity_threshold=0.95)
+    cache.put(1, cache.exact_key("q", "p"), "p", unit(1, 0, 0), {"answer": "a"})
+
+    assert cache.get_similar(1, "p", unit(1, 0.1, 0)) == {"answer": "a"}
+    assert cache.get_similar(1, "p", unit(1, 1, 0)) is None
+    assert cache.get_similar(1, "other params", unit(1, 0, 0)) is None
+
+
+def test_new_index_version_drops_both_tiers():
+    cache = AnswerCache(max_entries=4, ttl_seconds=60, similarity_threshold=0.9)
+    key = cache.exact_key("q", "p")
+    cache.put(1, key, "p", unit(1, 0), {"answer": "a"})
+
+    assert cache.get_exact(2, key) is None
+    assert cache.get_similar(2, "p", unit(1, 0)) is None
+    assert cache.get_exact(1, key) is None
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=f"answer {self.calls}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "off")
+    monkeypatch.setenv("ANSWER_CACHE", "on")
+    monkeypatch.setenv("INGEST_WORKERS", "1")
+    (tmp_path / "doc_page_001.json").write_text(json.dumps([
+        {"text": "Invoice INV-1001 total due 420 EUR"},
+        {"text": "Payment terms: 30 days net"},
+    ]))
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    svc = RagService(provider="hashing", client=client, async_client=client)
+    svc.index_recognition_dir(str(tmp_path))
+    svc.completions = completions
+    svc.rec = tmp_path
+    return svc
+
+
+def test_query_reuses_answers_until_the_index_changes(service):
+    first = service.query("What is the invoice total?")
+    assert service.query("  what is the INVOICE total? ") is first
+    # Punctuation changes the exact key but not the (hashing) embedding: semantic hit
+    assert service.query("What is the invoice total") is first
+    # Different retrieval parameters are a different cache entry
+    assert service.query("What is the invoice total?", max_sources=1)["answer"] == "answer 2"
+    assert service.completions.calls == 2
+
+    (service.rec / "doc_page_002.json").write_text(json.dumps([{"text": "Credit note CN-7"}]))
+    service.add_source(str(service.rec / "doc_page_002.json"))
+    assert service.query("What is the invoice total?")["answer"] == "answer 3"
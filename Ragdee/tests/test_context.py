@@ -0,0 +1,38 @@
+from rag_context import TRUNCATION_MARK, pack_context
+from rag_embeddings import estimate_tokens
+
+
+def line(text):
+    return (text, f"[Page 1, Line 1] {text}")
+
+
+def test_oversized_top_seed_is_truncated_not_dropped():
+    giant = "giant word " * 30000
+    groups = [[line(giant), line("neighbor")], [line("second seed")]]
+    kept = pack_context(groups, [2.0, 1.0], 500, estimate_tokens)
+
+    [(pos, rendered)] = kept[0]
+    assert pos == 0 and rendered.endswith(TRUNCATION_MARK)
+    assert estimate_tokens(rendered) + 1 <= 500
+    # The truncated seed used up the budget; lower groups are not cut
+    assert kept[1] == []
+
+
+def test_oversized_lower_seed_is_dropped():
+    groups = [[line("short seed")], [line("x " * 5000)]]
+    kept = pack_context(groups, [2.0, 1.0], 100, estimate_tokens)
+
+    assert [pos for pos, _ in kept[0]] == [0]
+    assert kept[1] == []
+
+
+def test_skips_duplicate_and_contained_lines():
+    groups = [
+        [line("Total due is 500 EUR"), line("Total due"), line("Page footer")],
+        [line("Page footer"), line("other")],
+    ]
+    kept = pack_context(groups, [2.0, 1.0], 1000, estimate_tokens)
+
+    assert [pos for pos, _ in kept[0]] == [0, 2]
+    # The second group's seed was already packed by the first group
+    assert kept[1] == []
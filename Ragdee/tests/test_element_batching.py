@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+for module in ("cv2", "torch", "transformers", "pymupdf", "PIL"):
+    pytest.importorskip(module)
+
+import demo_page  # noqa: E402
+
+
+class Crop:
+    """Stand-in for a PIL crop: plan_batches only reads .size."""
+
+    def __init__(self, width, height, tag=None):
+        self.size = (width, height)
+        self.tag = tag
+
+
+def random_crops(seed, n=40):
+    rng = random.Random(seed)
+    return [Crop(rng.randint(150, 800), rng.randint(20, 400)) for _ in range(n)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_plan_batches_covers_every_crop_once_largest_first(seed):
+    crops = random_crops(seed)
+    batches = demo_page.plan_batches(crops, 16, demo_page.DEFAULT_BATCH_AREA)
+
+    flat = [i for batch, _ in batches for i in batch]
+    assert sorted(flat) == list(range(len(crops)))
+    keys = [demo_page.element_size_key(crops[i]) for i in flat]
+    assert keys == sorted(keys, reverse=True)
+    # Consecutive cuts: every batch but the last is full
+    assert all(full for _, full in batches[:-1])
+
+
+def test_plan_batches_limits():
+    crops = [Crop(2000, 1000)] * 3 + [Crop(100, 20)] * 10
+    batches = demo_page.plan_batches(crops, 4, 4_000_000)
+    # A batch led by a 2000x1000 crop holds 2 under the area budget, the rest up to 4
+    assert [b for b, _ in batches] == [[0, 1], [2, 3], [4, 5, 6, 7], [8, 9, 10, 11], [12]]
+    assert [full for _, full in batches] == [True, True, True, True, False]
+
+    # max_batch_area=0 disables the area cap, max_batch_size=None the size cap
+    assert [len(b) for b, _ in demo_page.plan_batches(crops, 4, 0)] == [4, 4, 4, 1]
+    assert demo_page.plan_batches(crops, None, 0) == [(sorted(range(13), key=lambda i: i >= 3), False)]
+
+
+class FakeModel:
+    """DOLPHIN.chat stand-in: echoes each crop's tag and records batch sizes per prompt."""
+
+    def __init__(self):
+        self.batches = []
+
+    def chat(self, prompts, crops):
+        self.batches.append((prompts[0], len(crops)))
+        return [f"{prompt[:4]}:{crop.tag}" for prompt, crop in zip(prompts, crops)]
+
+
+def fake_pages(seed, n_pages):
+    """Per page: (figure results, elements) as collect_elements would return them."""
+    rng = random.Random(seed)
+    pages = []
+    for page in range(n_pages):
+        elements = []
+        for order in range(rng.randint(2, 8)):
+            label = rng.choice(["para", "para", "tab", "equ"])
+            elements.append({
+                "crop": Crop(rng.randint(50, 800), rng.randint(10, 300), tag=f"{page}.{order}"),
+                "label": label,
+                "bbox": [order, 0, 0, 0],
+                "reading_order": order,
+                "prompt": demo_page.ELEMENT_PROMPTS.get(label, demo_page.TEXT_PROMPT),
+            })
+        rng.shuffle(elements)
+        figures = [{"label": "fig", "text": "figure", "reading_order": 99}]
+        pages.append((figures, elements))
+    return pages
+
+
+def run_scheduler(monkeypatch, pages, max_batch_size, flush_every):
+    monkeypatch.setattr(demo_page, "collect_elements", lambda layout, *args: (list(pages[layout][0]), pages[layout][1]))
+    model = FakeModel()
+    scheduler = demo_page.ElementScheduler(model, max_batch_size)
+    released = []
+    for page in range(len(pages)):
+        scheduler.add_page(page, page, None, None, payload=f"payload {page}")
+        released += scheduler.pop_completed()
+        if scheduler.pending_pages >= flush_every:
+            released += scheduler.flush()
+    released += scheduler.flush()
+    return model, released
+
+
+def test_scheduler_releases_pages_in_order_with_results_in_reading_order(monkeypatch):
+    pages = fake_pages(0, 12)
+    model, released = run_scheduler(monkeypatch, pages, 4, flush_every=4)
+
+    assert [(key, payload) for key, payload, _ in released] == [(p, f"payload {p}") for p in range(12)]
+    for page, (_, _, results) in enumerate(released):
+        expected = sorted(pages[page][0] + pages[page][1], key=lambda e: e["reading_order"])
+        assert [r["reading_order"] for r in results] == [e["reading_order"] for e in expected]
+        for result, element in zip(results[:-1], expected[:-1]):
+            # Each result went back to the page and element it was decoded from
+            assert result["text"] == f"{element['prompt'][:4]}:{element['crop'].tag}"
+            assert result["bbox"] == element["bbox"]
+
+
+def test_scheduler_batches_across_pages(monkeypatch):
+    pages = fake_pages(1, 12)
+    per_page = FakeModel()
+    for _, elements in pages:
+        for prompt in {e["prompt"] for e in elements}:
+            same = [e for e in elements if e["prompt"] == prompt]
+            demo_page.process_element_batch(same, per_page, prompt, 4)
+
+    model, _ = run_scheduler(monkeypatch, pages, 4, flush_every=4)
+
+    assert sum(n for _, n in model.batches) == sum(n for _, n in per_page.batches)
+    assert all(n <= 4 for _, n in model.batches)
+    assert len(model.batches) < len(per_page.batches)
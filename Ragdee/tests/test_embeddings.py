@@ -0,0 +1,98 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from rag_embeddings import EmbeddingBatcher, estimate_tokens
+
+
+class FakeEmbeddings:
+    """embeddings.create stand-in: the vector of "t<i> ..." is [i, len(text)]."""
+
+    def __init__(self, failures=0, delay=None):
+        self.failures = failures
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def create(self, model, input, **kwargs):
+        with self._lock:
+            self.calls.append(list(input))
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("rate limited")
+        if self.delay:
+            time.sleep(self.delay(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(t.split()[0][1:]), float(len(t))]) for t in input])
+
+
+def make_batcher(embeddings, **kwargs):
+    kwargs.setdefault("max_items", 4)
+    kwargs.setdefault("max_tokens", 10_000)
+    kwargs.setdefault("max_input_tokens", 1_000)
+    kwargs.setdefault("max_workers", 1)
+    kwargs.setdefault("max_retries", 0)
+    return EmbeddingBatcher(SimpleNamespace(embeddings=embeddings), "fake-model", backoff=0, **kwargs)
+
+
+def texts(n):
+    return [f"t{i}" for i in range(n)]
+
+
+def test_splits_by_item_limit():
+    fake = FakeEmbeddings()
+    out = make_batcher(fake).embed(texts(10))
+    assert [len(c) for c in fake.calls] == [4, 4, 2]
+    assert out.dtype == np.float32 and out.shape == (10, 2)
+
+
+def test_splits_by_token_budget():
+    fake = FakeEmbeddings()
+    batch = ["t%d" % i + " " * 40 for i in range(6)]
+    per_text = estimate_tokens(batch[0])
+    batcher = make_batcher(fake, max_items=100, max_tokens=2 * per_text)
+    assert batcher.plan_batches(batch) == [(0, 2), (2, 4), (4, 6)]
+    batcher.embed(batch)
+    assert [len(c) for c in fake.calls] == [2, 2, 2]
+
+
+def test_truncates_oversized_inputs():
+    fake = FakeEmbeddings()
+    batcher = make_batcher(fake, max_items=100, max_tokens=50, max_input_tokens=20)
+    long = "t1 " + "x" * 500
+    batcher.embed(["t0", long, "t2"])
+    assert all(estimate_tokens(t) <= 20 for call in fake.calls for t in call)
+    sent = [t for call in fake.calls for t in call]
+    assert sent[0] == "t0" and sent[2] == "t2" and sent[1].startswith("t1 ") and len(sent[1]) < len(long)
+
+
+def test_retries_failed_batches():
+    fake = FakeEmbeddings(failures=2)
+    out = make_batcher(fake, max_retries=2).embed(texts(3))
+    assert len(fake.calls) == 3
+    assert out[:, 0].tolist() == [0.0, 1.0, 2.0]
+
+
+def test_gives_up_after_max_retries():
+    fake = FakeEmbeddings(failures=5)
+    with pytest.raises(RuntimeError):
+        make_batcher(fake, max_retries=1).embed(texts(3))
+    assert len(fake.calls) == 2
+
+
+def test_keeps_input_order_when_batches_finish_out_of_order():
+    # Earlier batches are slower, so they complete last
+    fake = FakeEmbeddings(delay=lambda batch: 0.05 / (1 + int(batch[0][1:])))
+    progress = []
+    batcher = make_batcher(fake, max_items=3, max_workers=4, progress=lambda done, total: progress.append((done, total)))
+    out = batcher.embed(texts(11))
+    assert out[:, 0].tolist() == [float(i) for i in range(11)]
+    assert progress[-1] == (11, 11)
+
+
+def test_empty_input():
+    fake = FakeEmbeddings()
+    assert make_batcher(fake).embed([]).shape == (0, 0)
+    assert fake.calls == []
@@ -0,0 +1,157 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from rag_embedding_providers import HashingEmbeddingProvider
+from rag_service import RagService
+
+
+class CountingProvider(HashingEmbeddingProvider):
+    """Hashing embeddings that record every text sent for embedding."""
+
+    def __init__(self):
+        super().__init__()
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return super().embed(texts)
+
+
+def write_page(directory, page, texts):
+    path = os.path.join(directory, f"doc_page_{page:03d}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{"text": t} for t in texts], f)
+    return path
+
+
+def page_texts(page, n=6):
+    return [f"page {page} line {i} invoice INV-{page}{i:02d} amount {17 * page + i}" for i in range(n)]
+
+
+def chunk_rows(svc):
+    return sorted((c.source, c.page, c.line, c.text) for c in svc._chunks)
+
+
+def related_texts(svc):
+    chunks = svc._chunks
+    return sorted(
+        (chunks[i].text, tuple(sorted(chunks[j].text for j in svc._relations.neighbors(i)[0].tolist())))
+        for i in range(len(chunks))
+    )
+
+
+def assert_same_index(svc, ref):
+    assert chunk_rows(svc) == chunk_rows(ref)
+    assert svc._embeddings.shape == ref._embeddings.shape
+    assert len(svc._relations) == len(svc._chunks)
+    # Row i of the matrix still belongs to chunk i after compaction
+    by_text = {c.text: ref._embeddings[i] for i, c in enumerate(ref._chunks)}
+    for i, c in enumerate(svc._chunks):
+        np.testing.assert_allclose(svc._embeddings[i], by_text[c.text], rtol=1e-6)
+    assert related_texts(svc) == related_texts(ref)
+    # Full rankings (row ids differ, so compare texts and scores)
+    for question in ("INV-203", "page 4 amount", "fresh text"):
+        assert ranking(svc, question, "lexical") == ranking(ref, question, "lexical")
+        assert ranking(svc, question, "vector") == ranking(ref, question, "vector")
+
+
+def ranking(svc, question, mode):
+    state = svc._state
+    q_emb = svc._embed_query(question) if mode == "vector" else None
+    ids, scores = svc._retrieve(state, question, q_emb, len(state.chunks), mode)
+    return sorted((round(float(s), 4), state.chunks.texts[i]) for i, s in zip(ids.tolist(), scores.tolist()))
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "off")
+    monkeypatch.setenv("INGEST_WORKERS", "1")
+    rec = tmp_path / "recognition_json"
+    rec.mkdir()
+    for page in range(1, 5):
+        write_page(str(rec), page, page_texts(page))
+    provider = CountingProvider()
+    svc = RagService(embedding_provider=provider)
+    svc.index_recognition_dir(str(rec))
+    provider.embedded.clear()
+    return str(rec), svc, provider
+
+
+def fresh_index(rec):
+    ref = RagService(provider="hashing")
+    ref.index_recognition_dir(rec)
+    return ref
+
+
+def test_add_source_embeds_only_new_text(env):
+    rec, svc, provider = env
+    path = write_page(rec, 9, ["fresh text on a new page", "page 9 second line"])
+
+    assert svc.add_source(path) == 2
+    assert provider.embedded == ["fresh text on a new page", "page 9 second line"]
+    assert_same_index(svc, fresh_index(rec))
+
+
+def test_remove_source_compacts_rows(env):
+    rec, svc, provider = env
+    version = svc._version
+    path = os.path.join(rec, "doc_page_002.json")
+    os.remove(path)
+
+    assert svc.remove_source(path) == 6
+    assert svc._version == version + 1
+    assert provider.embedded == []
+    assert len(svc._chunks) == 18
+    assert_same_index(svc, fresh_index(rec))
+
+
+def test_sync_applies_add_update_and_remove(env):
+    rec, svc, provider = env
+    os.remove(os.path.join(rec, "doc_page_001.json"))
+    texts = page_texts(3)
+    texts[2] = "fresh text replacing one line"
+    write_page(rec, 3, texts)
+    write_page(rec, 7, ["page 7 brand new"])
+
+    changes = svc.sync_recognition_dir(rec)
+
+    assert changes == {"added": 1, "updated": 1, "removed": 1, "unchanged": 2, "chunks": 19}
+    # Unchanged lines of the updated page reuse their vectors
+    assert sorted(provider.embedded) == ["fresh text replacing one line", "page 7 brand new"]
+    assert_same_index(svc, fresh_index(rec))
+    assert svc.sync_recognition_dir(rec)["unchanged"] == 4
+
+
+def test_queries_keep_their_version_during_a_change(env):
+    rec, svc, _ = env
+    state = svc._state
+    svc.remove_source(os.path.join(rec, "doc_page_001.json"))
+
+    # The captured version is untouched: columns, matrix and graph still line up
+    assert len(state.chunks) == state.embeddings.shape[0] == len(state.relations) == 24
+    assert svc._state is not state and len(svc._chunks) == 18
+
+
+def test_ivf_cells_are_kept_for_small_changes(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "off")
+    monkeypatch.setenv("INGEST_WORKERS", "1")
+    monkeypatch.setenv("VECTOR_INDEX", "ivf")
+    monkeypatch.setenv("IVF_NPROBE", "1000")  # probe every cell: results must equal exact search
+    rec = str(tmp_path)
+    for page in range(1, 11):
+        write_page(rec, page, page_texts(page))
+    svc = RagService(provider="hashing")
+    svc.index_recognition_dir(rec)
+    before = svc._state.vindex
+
+    svc.add_source(write_page(rec, 11, ["fresh text on a new page"]))
+    svc.remove_source(os.path.join(rec, "doc_page_004.json"))
+    os.remove(os.path.join(rec, "doc_page_004.json"))
+
+    after = svc._state.vindex
+    assert after is not before and after.centroids is before.centroids
+    assert sorted(after.list_ids.tolist()) == list(range(len(svc._chunks)))
+    assert ranking(svc, "fresh text", "vector") == ranking(fresh_index(rec), "fresh text", "vector")
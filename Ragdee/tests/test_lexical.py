@@ -0,0 +1,79 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from rag_lexical import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def reference_bm25(texts, query, k1=1.5, b=0.75):
+    """Textbook Okapi BM25 over tokenize(), one document at a time."""
+    docs = [tokenize(t) for t in texts]
+    avgdl = sum(len(d) for d in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in d for d in docs)
+            tf = doc.count(term)
+            if tf:
+                idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avgdl))
+        scores.append(score)
+    return scores
+
+
+def corpus(seed, n=120):
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(40)] + ["INV-2024-001", "total", "due"]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(0, 15))) for _ in range(n)]
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("Invoice INV-2024-001, 3.14") == ["invoice", "inv-2024-001", "inv", "2024", "001", "3.14", "3", "14"]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_scores_match_reference_bm25(seed):
+    texts = corpus(seed)
+    index = BM25Index().build(texts)
+    for query in ("w1 w2", "inv-2024-001 total", "2024 due w39"):
+        expected = reference_bm25(texts, query)
+        ids, scores = index.search(query, len(texts))
+        assert all(expected[i] > 0 for i in ids.tolist())
+        assert len(ids) == sum(s > 0 for s in expected)
+        np.testing.assert_allclose(scores, [expected[i] for i in ids.tolist()], rtol=1e-5)
+        assert list(scores) == sorted(scores, reverse=True)
+
+
+def test_top_k_and_no_match():
+    index = BM25Index().build(["alpha beta", "beta gamma", "gamma delta"])
+    ids, _ = index.search("beta", 1)
+    assert len(ids) == 1 and ids[0] in (0, 1)
+    assert index.search("zeta", 5)[0].shape == (0,)
+    assert BM25Index().build([]).search("alpha", 3)[0].shape == (0,)
+
+
+def test_update_matches_full_rebuild():
+    texts = corpus(7)
+    rng = np.random.default_rng(0)
+    kept = rng.random(len(texts)) > 0.2
+    added = corpus(8, n=15)
+    new_texts = [t for t, keep in zip(texts, kept) if keep] + added
+    updated = BM25Index().build(texts).update(kept, added)
+    rebuilt = BM25Index().build(new_texts)
+    assert updated.n_docs == len(new_texts)
+    for query in ("w1 w2", "inv-2024-001", "due w5"):
+        a_ids, a_scores = updated.search(query, len(new_texts))
+        b_ids, b_scores = rebuilt.search(query, len(new_texts))
+        assert sorted(zip(a_ids.tolist(), np.round(a_scores, 5).tolist())) == sorted(
+            zip(b_ids.tolist(), np.round(b_scores, 5).tolist())
+        )
+
+
+def test_reciprocal_rank_fusion():
+    ids, scores = reciprocal_rank_fusion([np.array([3, 1, 2]), np.array([1, 4])], k=3, rrf_k=60)
+    # 1 is ranked by both lists, so it beats 3 (first in only one)
+    assert ids.tolist() == [1, 3, 4]
+    np.testing.assert_allclose(scores, [1 / 62 + 1 / 61, 1 / 61, 1 / 62])
@@ -0,0 +1,43 @@
+import json
+import threading
+import time
+
+from rag_registry import IndexRegistry
+from rag_service import RagService
+
+
+def test_concurrent_gets_load_an_evicted_index_once(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "off")
+    calls = []
+
+    def loader(name):
+        calls.append(name)
+        time.sleep(0.05)
+        return RagService(provider="hashing", client=object(), async_client=object())
+
+    registry = IndexRegistry(memory_budget_bytes=1 << 30, loader=loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("tenant-a"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == ["tenant-a"]
+    assert len({id(svc) for svc in results}) == 1
+
+
+def test_reloaded_index_keeps_its_answer_model(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "off")
+    monkeypatch.setenv("ANSWER_MODEL", "env-default-model")
+    rec = tmp_path / "recognition_json"
+    rec.mkdir()
+    (rec / "doc_page_001.json").write_text(json.dumps([{"text": "alpha"}, {"text": "beta"}]))
+    snapshot_dir = str(tmp_path / "snapshot")
+    svc = RagService(provider="hashing", answer_model="tenant-model", api_key_env="TENANT_KEY", snapshot_dir=snapshot_dir)
+    svc.index_recognition_dir(str(rec))
+
+    reloaded = RagService.from_snapshot(snapshot_dir)
+
+    assert (reloaded.answer_model, reloaded.api_key_env) == ("tenant-model", "TENANT_KEY")
+    assert RagService.from_snapshot(snapshot_dir, answer_model="override").answer_model == "override"
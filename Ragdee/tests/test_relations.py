@@ -0,0 +1,60 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pytest
+
+from rag_relations import RelationGraph
+
+
+def per_page_relations(pages: np.ndarray, lines: np.ndarray, window: int) -> Dict[int, List[int]]:
+    """The per-page loop RelationGraph.build replaced, kept as the reference."""
+    relations: Dict[int, List[int]] = {}
+    by_page: Dict[int, List[Tuple[int, int]]] = {}
+    for idx, (page, line) in enumerate(zip(pages.tolist(), lines.tolist())):
+        by_page.setdefault(page, []).append((idx, line))
+    for pairs in by_page.values():
+        pairs.sort(key=lambda x: x[1])
+        for i, (idx, line) in enumerate(pairs):
+            neighbors: List[int] = []
+            j = i - 1
+            while j >= 0 and abs(pairs[j][1] - line) <= window:
+                neighbors.append(pairs[j][0])
+                j -= 1
+            k = i + 1
+            while k < len(pairs) and abs(pairs[k][1] - line) <= window:
+                neighbors.append(pairs[k][0])
+                k += 1
+            relations[idx] = neighbors
+    return relations
+
+
+def assert_matches_reference(pages: np.ndarray, lines: np.ndarray, window: int) -> None:
+    graph = RelationGraph.build(pages, lines, window)
+    expected = per_page_relations(pages, lines, window)
+    assert len(graph) == len(pages)
+    for i in range(len(pages)):
+        ids, deltas = graph.neighbors(i)
+        assert ids.tolist() == expected[i], (i, ids.tolist(), expected[i])
+        assert deltas.tolist() == np.abs(lines[ids] - lines[i]).tolist()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_build_matches_per_page_loop(seed):
+    # Few pages and lines relative to rows, so duplicate (page, line) pairs are common
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 400))
+    pages = rng.integers(0, 6, n).astype(np.int32)
+    lines = rng.integers(0, 50, n).astype(np.int32)
+    assert_matches_reference(pages, lines, int(rng.integers(0, 5)))
+
+
+def test_build_matches_per_page_loop_extreme_values():
+    pages = np.array([0, 0, -1, 2**31 - 1, 2**31 - 1, 0, -1], dtype=np.int32)
+    lines = np.array([2**31 - 1, 2**31 - 2, -(2**31), 0, 1, -5, -(2**31) + 1], dtype=np.int32)
+    for window in (0, 1, 3):
+        assert_matches_reference(pages, lines, window)
+
+
+def test_build_empty():
+    graph = RelationGraph.build(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), 2)
+    assert len(graph) == 0 and graph.nbytes() == 8
@@ -0,0 +1,90 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from rag_service import RagService
+
+
+def chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCompletions:
+    """chat.completions.create stand-in that streams `deltas` (None = empty delta, "" = no choices)."""
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        assert kwargs.get("stream") is True
+        return FakeStream([SimpleNamespace(choices=[]) if d == "" else chunk(d) for d in self.deltas])
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "off")
+    monkeypatch.setenv("ANSWER_CACHE", "on")
+    rec = tmp_path / "recognition_json"
+    rec.mkdir()
+    (rec / "doc_page_001.json").write_text(json.dumps([
+        {"text": "Invoice INV-1001 total due 420 EUR"},
+        {"text": "Payment terms: 30 days net"},
+    ]))
+    (rec / "doc_page_002.json").write_text(json.dumps([{"text": "Shipping address: 12 Harbour Road"}]))
+    completions = FakeCompletions(["The total ", None, "", "is 420 EUR."])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    svc = RagService(provider="hashing", client=client, async_client=client)
+    svc.index_recognition_dir(str(rec))
+    svc.completions = completions
+    return svc
+
+
+async def collect(agen):
+    return [event async for event in agen]
+
+
+def test_astream_query_events(service):
+    events = asyncio.run(collect(service.astream_query("What is the invoice total?", mode="hybrid")))
+
+    assert [e["type"] for e in events] == ["sources", "token", "token", "done"]
+    assert any("INV-1001" in s["text"] for s in events[0]["sources"])
+    assert [e["text"] for e in events[1:3]] == ["The total ", "is 420 EUR."]
+    assert events[-1]["answer"] == "The total is 420 EUR."
+    prompt = service.completions.calls[0]["messages"][-1]["content"]
+    assert "What is the invoice total?" in prompt and "INV-1001" in prompt
+
+
+def test_astream_query_replays_cached_answer(service):
+    question = "What is the invoice total?"
+    asyncio.run(collect(service.astream_query(question)))
+    events = asyncio.run(collect(service.astream_query(question)))
+
+    assert len(service.completions.calls) == 1
+    assert [e["type"] for e in events] == ["sources", "token", "done"]
+    assert events[1]["text"] == events[2]["answer"] == "The total is 420 EUR."
+
+
+def test_astream_query_without_index(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "off")
+    svc = RagService(provider="hashing", client=SimpleNamespace(), async_client=SimpleNamespace())
+    events = asyncio.run(collect(svc.astream_query("anything")))
+
+    assert events == [{"type": "sources", "sources": []}, {"type": "done", "answer": RagService.NO_CONTENT_ANSWER}]
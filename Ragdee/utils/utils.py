@@ -51,23 +51,22 @@ def save_figure_to_local(pil_crop, save_dir, image_name, reading_order):
         return f"{image_name}_figure_{reading_order:03d}_error.png"
 
 
-def convert_pdf_to_images(pdf_path, target_size=896):
-    """Convert PDF pages to images
+def iter_pdf_images(pdf_path, target_size=896):
+    """Render PDF pages one at a time
+
+    Only the page being rendered is held here, so callers that consume pages as
+    they arrive keep memory bounded regardless of the page count.
 
     Args:
         pdf_path: Path to PDF file
         target_size: Target size for the longest dimension
 
-    Returns:
-        List of PIL Images
+    Yields:
+        PIL Image of each page, in page order
     """
-    images = []
+    doc = pymupdf.open(pdf_path)
     try:
-        doc = pymupdf.open(pdf_path)
-
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-
+        for page in doc:
             # Calculate scale to make longest dimension equal to target_size
             rect = page.rect
             scale = target_size / max(rect.width, rect.height)
@@ -76,12 +75,40 @@ def convert_pdf_to_images(pdf_path, target_size=896):
             mat = pymupdf.Matrix(scale, scale)
             pix = page.get_pixmap(matrix=mat)
 
-            # Convert to PIL Image
+            # Convert to PIL Image; decode now so the work happens in the rendering stage
             img_data = pix.tobytes("png")
             pil_image = Image.open(io.BytesIO(img_data))
-            images.append(pil_image)
-
+            pil_image.load()
+            yield pil_image
+    finally:
         doc.close()
+
+
+def count_pdf_pages(pdf_path):
+    """Number of pages in a PDF, or 0 if it cannot be opened"""
+    try:
+        doc = pymupdf.open(pdf_path)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+    except Exception as e:
+        print(f"Error opening PDF: {str(e)}")
+        return 0
+
+
+def convert_pdf_to_images(pdf_path, target_size=896):
+    """Convert PDF pages to images
+
+    Args:
+        pdf_path: Path to PDF file
+        target_size: Target size for the longest dimension
+
+    Returns:
+        List of PIL Images
+    """
+    try:
+        images = list(iter_pdf_images(pdf_path, target_size))
         print(f"Successfully converted {len(images)} pages from PDF")
         return images
 